@@ -0,0 +1,182 @@
+#
+# Copyright (c) 2017-2019 Minato Sato
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import sys
+sys.path.append('../')
+
+import time
+
+from functools import partial
+
+import numpy as np
+
+import nnabla as nn
+import nnabla.functions as F
+import nnabla.parametric_functions as PF
+
+from common.parametric_functions import lstm
+from common.parametric_functions import lstm_cell
+from common.parametric_functions import simple_rnn
+from common.parametric_functions import where
+from common.parametric_functions import lstm_weights_to_fused
+from common.parametric_functions import fused_to_lstm_weights
+from common.parametric_functions import rnn_weights_to_fused
+from common.parametric_functions import fused_to_rnn_weights
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark of the lstm layer at the IMDB shapes.')
+parser.add_argument('--context', '-c', type=str,
+                    default='cpu', help='You can choose cpu or cudnn.')
+parser.add_argument('--device', '-d', type=int,
+                    default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--batch-size', type=int, default=32)
+parser.add_argument('--length', type=int, default=400)
+parser.add_argument('--embedding-size', type=int, default=128)
+parser.add_argument('--units', type=int, nargs='+', default=[128, 300])
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+if args.context == 'cudnn':
+    from nnabla.ext_utils import get_extension_context
+    ctx = get_extension_context('cudnn', device_id=args.device)
+    nn.set_default_context(ctx)
+
+
+@PF.parametric_function_api('lstm')
+def per_step_lstm(inputs: nn.Variable, units: int, mask: nn.Variable, fix_parameters: bool = False) -> nn.Variable:
+    '''
+    The original implementation of `lstm` with `lstm_cell`, as the reference of the other backends.
+    '''
+    batch_size, length, embedding_size = inputs.shape
+    cell = F.constant(0, shape=(batch_size, units))
+    hidden = F.constant(0, shape=(batch_size, units))
+    for x, cond in zip(F.split(inputs, axis=1), F.split(mask, axis=1)):
+        cell_t, hidden_t = lstm_cell(x, cell, hidden)
+        cell = where(cond, cell_t, cell)
+        hidden = where(cond, hidden_t, hidden)
+    return hidden
+
+
+def check_per_step(units, batch_size=4, length=7, embedding_size=5):
+    '''
+    Check that `lstm` with backend='graph' and 'hoisted' gives the same output and gradients as the per-step one
+    on the same parameters, with a post-padding mask.
+    '''
+    nn.clear_parameters()
+    rng = np.random.RandomState(313)
+    x = nn.Variable((batch_size, length, embedding_size), need_grad=True)
+    mask = nn.Variable((batch_size, length, 1))
+    x.d = rng.randn(*x.shape)
+    mask.d = (np.arange(length) < rng.randint(1, length + 1, size=(batch_size, 1)))[..., None]
+    results = []
+    for layer in (per_step_lstm, lstm, partial(lstm, backend='hoisted')):
+        y = layer(x, units, mask=mask)
+        y.forward()
+        nn.get_parameters()['lstm/affine/W'].grad.zero()
+        x.grad.zero()
+        y.backward(np.cos(np.arange(y.size)).reshape(y.shape))
+        results.append((y.d.copy(), x.g.copy(), nn.get_parameters()['lstm/affine/W'].g.copy()))
+    for result in results[1:]:
+        for expected, actual in zip(results[0], result):
+            assert np.allclose(expected, actual, atol=1e-6), 'lstm differs from the per-step one.'
+
+
+def check_fused(layer, units, batch_size=4, length=7, embedding_size=5):
+    '''
+    Check that backend='hoisted' and 'fused' give the same outputs and gradients as backend='graph'
+    on the same parameters, with and without a post-padding mask.
+    '''
+    rng = np.random.RandomState(313)
+    x = nn.Variable((batch_size, length, embedding_size), need_grad=True)
+    x.d = rng.randn(*x.shape)
+    mask = nn.Variable((batch_size, length, 1))
+    mask.d = (np.arange(length) < rng.randint(1, length + 1, size=(batch_size, 1)))[..., None]
+    for m in (None, mask):
+        for return_sequences in (False, True):
+            nn.clear_parameters()
+            results = []
+            for backend in ('graph', 'hoisted', 'fused'):
+                y = layer(x, units, mask=m, return_sequences=return_sequences, backend=backend)
+                y.forward()
+                for parameter in nn.get_parameters().values():
+                    parameter.grad.zero()
+                x.grad.zero()
+                y.backward(np.cos(np.arange(y.size)).reshape(y.shape))
+                results.append([y.d.copy(), x.g.copy()] + [p.g.copy() for p in nn.get_parameters().values()])
+            for backend, result in zip(('hoisted', 'fused'), results[1:]):
+                for expected, actual in zip(results[0], result):
+                    assert np.allclose(expected, actual, atol=1e-5), \
+                        f"backend='{backend}' of {layer.__name__} differs from backend='graph'."
+
+
+def check_converters(units, embedding_size=5, batch_size=4, length=7):
+    '''
+    Check that the converters round-trip, and that `F.lstm` and `F.rnn` on converted parameters
+    give the same outputs as the graph backend.
+    '''
+    rng = np.random.RandomState(313)
+    x = nn.Variable.from_numpy_array(rng.randn(batch_size, length, embedding_size))
+    h0 = nn.Variable.from_numpy_array(np.zeros((1, 1, batch_size, units)))
+    for layer, to_fused, from_fused, gates in ((lstm, lstm_weights_to_fused, fused_to_lstm_weights, 4),
+                                              (simple_rnn, rnn_weights_to_fused, fused_to_rnn_weights, 1)):
+        W = rng.randn(embedding_size + units, gates * units) / np.sqrt(embedding_size + units)
+        b = rng.randn(gates * units)
+        W_back, b_back = from_fused(*to_fused(W, b))
+        assert np.array_equal(W, W_back) and np.array_equal(b, b_back), f'converters of {layer.__name__} do not round-trip.'
+
+        nn.clear_parameters()
+        y = layer(x, units, return_sequences=True)
+        nn.get_parameters()[f'{layer.__name__}/affine/W'].d = W
+        nn.get_parameters()[f'{layer.__name__}/affine/b'].d = b
+        y.forward()
+        weight_l0, bias = map(nn.Variable.from_numpy_array, to_fused(W, b))
+        xs = F.transpose(x, (1, 0, 2))
+        if layer is lstm:
+            ys = F.lstm(xs, h0, h0, weight_l0, bias=bias)[0]
+        else:
+            ys = F.rnn(xs, h0, weight_l0, bias=bias)[0]
+        ys.forward()
+        assert np.allclose(y.d, np.transpose(ys.d, (1, 0, 2)), atol=1e-5), \
+            f'the fused kernel on converted parameters differs from {layer.__name__}.'
+
+
+def measure(name, layer, units):
+    nn.clear_parameters()
+    x = nn.Variable((args.batch_size, args.length, args.embedding_size), need_grad=True)
+    mask = nn.Variable((args.batch_size, args.length, 1))
+    x.d = np.random.randn(*x.shape)
+    mask.d = 1
+    y = F.sum(layer(x, units, mask=mask))
+
+    forward, backward = [], []
+    for _ in range(args.repeat + 1):
+        start = time.perf_counter()
+        y.forward()
+        # synchronize with the device.
+        _ = y.d
+        forward.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        y.backward()
+        _ = x.g
+        backward.append(time.perf_counter() - start)
+    # the first run is a warm-up.
+    print(f'{name:>16} (units={units}): {min(forward[1:])*1000:9.1f} ms forward, {min(backward[1:])*1000:9.1f} ms backward')
+
+
+for units in args.units:
+    check_per_step(units)
+    check_fused(lstm, units)
+    check_fused(simple_rnn, units)
+    check_converters(units)
+print('the graph and hoisted backends match the per-step lstm, and the hoisted and fused backends match the graph backend.')
+
+print(f'batch_size={args.batch_size}, length={args.length}, embedding_size={args.embedding_size}')
+for units in args.units:
+    measure('graph', lstm, units)
+    measure('hoisted', partial(lstm, backend='hoisted'), units)
+    measure('fused', partial(lstm, backend='fused'), units)
@@ -0,0 +1,67 @@
+# 
+# Copyright (c) 2017-2019 Minato Sato
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import sys
+sys.path.append('../')
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from typing import List
+
+from common.utils import load_imdb
+from common.utils import to_flat
+from common.utils import pad_flat
+from common.utils import with_padding
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark of with_padding on IMDB.')
+parser.add_argument('--max-len', type=int, default=400)
+parser.add_argument('--vocab-size', type=int, default=20000)
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+
+def list_padding(sequences: List[List[int]], padding_type: str = 'post',
+                 max_sequence_length: int = 0) -> np.ndarray:
+    # the former list based implementation.
+    def _with_padding(sequence: List[int]) -> List[int]:
+        sequence = sequence[:max_sequence_length]
+        pad_length = max_sequence_length - len(sequence)
+        if padding_type == 'post':
+            return sequence + [0] * pad_length
+        else:
+            return [0] * pad_length + sequence
+    return np.array(list(map(_with_padding, sequences)), dtype=np.int32)
+
+
+def measure(name, func, *func_args):
+    elapsed = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        func(*func_args)
+        elapsed.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(*func_args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>24}: {min(elapsed)*1000:9.1f} ms, peak {peak/2**20:8.1f} MiB')
+
+
+x_train, x_test, y_train, y_test = load_imdb(args.vocab_size)
+x_train = [list(sentence) for sentence in x_train]
+tokens, offsets = to_flat(x_train)
+
+print(f'{len(x_train)} sequences, {len(tokens)} tokens, max_len={args.max_len}')
+for padding_type in ['post', 'pre']:
+    print(f'padding_type={padding_type}')
+    measure('list (former)', list_padding, x_train, padding_type, args.max_len)
+    measure('with_padding', with_padding, x_train, padding_type, args.max_len)
+    measure('pad_flat', pad_flat, tokens, offsets, padding_type, args.max_len)
@@ -0,0 +1,178 @@
+#
+# Copyright (c) 2017-2019 Minato Sato
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import queue
+import threading
+
+import numpy as np
+
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+class BatchIterator(object):
+    '''
+    A data iterator whose loader receives the indices of a whole batch,
+    so that a batch is assembled by a single fancy-indexing gather such as `x[indices]`.
+    Like `nnabla.utils.data_iterator.DataIterator`, an epoch which does not end
+    at a batch boundary continues into the next (reshuffled) epoch.
+    Args:
+        load_func (Callable): load_func(indices) returns a tuple of batch arrays.
+        num_examples (int): The number of examples.
+        batch_size (int): The number of examples in a batch.
+        shuffle (bool): Whether to shuffle examples every epoch.
+        rng (numpy.random.RandomState): A random number generator.
+    '''
+    def __init__(self, load_func: Callable[[np.ndarray], Tuple[np.ndarray, ...]], num_examples: int,
+                 batch_size: int, shuffle: bool = False, rng: Optional[np.random.RandomState] = None) -> None:
+        self.load_func = load_func
+        self.size = num_examples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = rng if rng is not None else np.random.RandomState(313)
+
+        self._order = self._permutation()
+        self._position = 0
+        self.variables = tuple(f'x{i}' for i in range(len(load_func(self._order[:batch_size]))))
+
+    def _permutation(self) -> np.ndarray:
+        if self.shuffle:
+            return self.rng.permutation(self.size)
+        return np.arange(self.size)
+
+    def next(self) -> Tuple[np.ndarray, ...]:
+        while len(self._order) - self._position < self.batch_size:
+            self._order = np.concatenate([self._order[self._position:], self._permutation()])
+            self._position = 0
+        indices = self._order[self._position:self._position+self.batch_size]
+        self._position += self.batch_size
+        return tuple(self.load_func(indices))
+
+
+def data_iterator_batch(load_func: Callable[[np.ndarray], Tuple[np.ndarray, ...]], num_examples: int,
+                        batch_size: int, shuffle: bool = False,
+                        rng: Optional[np.random.RandomState] = None) -> BatchIterator:
+    '''
+    A batch-level counterpart of `nnabla.utils.data_iterator.data_iterator_simple`.
+    `load_func` receives an index array of a batch instead of a single index.
+    '''
+    return BatchIterator(load_func, num_examples, batch_size, shuffle=shuffle, rng=rng)
+
+
+class BucketIterator(object):
+    '''
+    A data iterator which groups samples of similar length into the same batch.
+    Each batch is padded only up to its bucket length, i.e. the length of its samples
+    rounded up to a multiple of `bucket_width` (and clipped to `max_length`),
+    so that the number of distinct batch shapes is small.
+    The last batch of a bucket holds the rest of its samples and may be smaller than the others.
+    With `max_tokens`, the batch size of each bucket is chosen so that a batch holds
+    at most `max_tokens` (padded) tokens, which keeps the cost of every step about the same.
+    Args:
+        lengths (numpy.ndarray): A shape of (number_of_samples, ) or (number_of_samples, number_of_sequences)
+                                 when a sample consists of several sequences (e.g. a source and a target).
+        load_func (Callable): load_func(indices, *lengths) returns a tuple of batch arrays
+                              whose sequences are padded to `lengths`.
+        batch_size (int): The number of samples in a batch. With `max_tokens`, the upper limit of it (0 means no limit).
+        bucket_width (int): Granularity of bucket lengths.
+        max_length (int): Longer samples are put into the bucket of `max_length`. 0 means no limit.
+        max_tokens (int): The token budget of a batch, summed over the sequences of a sample. 0 means a fixed batch size.
+        shuffle (bool): Whether to shuffle samples and batches every epoch.
+        rng (numpy.random.RandomState): A random number generator.
+    '''
+    def __init__(self, lengths: np.ndarray, load_func: Callable[..., Tuple[np.ndarray, ...]],
+                 batch_size: int = 0, bucket_width: int = 10, max_length: int = 0, max_tokens: int = 0,
+                 shuffle: bool = False, rng: Optional[np.random.RandomState] = None) -> None:
+        assert bucket_width > 0, 'bucket_width must be a positive integer.'
+        assert batch_size > 0 or max_tokens > 0, 'either batch_size or max_tokens must be given.'
+
+        self.load_func = load_func
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.rng = rng if rng is not None else np.random.RandomState(313)
+
+        lengths = np.asarray(lengths)
+        if lengths.ndim == 1:
+            lengths = lengths[:, None]
+        bucket_lengths = np.maximum(-(-lengths // bucket_width) * bucket_width, bucket_width)
+        if max_length > 0:
+            bucket_lengths = np.minimum(bucket_lengths, max_length)
+        keys, inverse = np.unique(bucket_lengths, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        self.buckets: List[Tuple[Tuple[int, ...], np.ndarray]] = \
+            [(tuple(int(length) for length in key), np.flatnonzero(inverse == i)) for i, key in enumerate(keys)]
+
+        self.size = len(lengths)
+        self.num_batch = sum(-(-len(indices) // self._bucket_batch_size(key)) for key, indices in self.buckets)
+
+        self._batches: List[Tuple[np.ndarray, Tuple[int, ...]]] = []
+        first_indices, first_key = self._make_batches()[0]
+        self.variables = tuple(f'x{i}' for i in range(len(load_func(first_indices, *first_key))))
+
+    def _bucket_batch_size(self, key: Tuple[int, ...]) -> int:
+        if self.max_tokens == 0:
+            return self.batch_size
+        batch_size = max(1, self.max_tokens // sum(key))
+        if self.batch_size > 0:
+            batch_size = min(batch_size, self.batch_size)
+        return batch_size
+
+    def _make_batches(self) -> List[Tuple[np.ndarray, Tuple[int, ...]]]:
+        batches = []
+        for key, indices in self.buckets:
+            batch_size = self._bucket_batch_size(key)
+            if self.shuffle:
+                indices = self.rng.permutation(indices)
+            # the last batch of the bucket may be smaller, so that every sample is used exactly once per epoch.
+            for i in range(0, len(indices), batch_size):
+                batches.append((indices[i:i+batch_size], key))
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+    def next(self) -> Tuple[np.ndarray, ...]:
+        if len(self._batches) == 0:
+            self._batches = self._make_batches()[::-1]
+        indices, key = self._batches.pop()
+        return self.load_func(indices, *key)
+
+
+class Prefetcher(object):
+    '''
+    A data iterator which prepares the next batches of `iterator` in a worker thread,
+    so that loading data overlaps with the forward and backward computation.
+    Batches are made contiguous in the worker, and at most `depth` of them are queued.
+    Args:
+        iterator: A data iterator which has `next()`.
+        num_batch (int): The number of batches to prepare.
+        depth (int): The maximum number of prepared batches.
+    '''
+    def __init__(self, iterator, num_batch: int, depth: int = 2) -> None:
+        self.iterator = iterator
+        self.batch_size = iterator.batch_size
+        self.size = iterator.size
+        self.variables = iterator.variables
+        self.queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._worker = threading.Thread(target=self._prefetch, args=(num_batch, ), daemon=True)
+        self._worker.start()
+
+    def _prefetch(self, num_batch: int) -> None:
+        try:
+            for _ in range(num_batch):
+                self.queue.put(tuple(np.ascontiguousarray(data) for data in self.iterator.next()))
+        except Exception as e:
+            self.queue.put(e)
+
+    def next(self) -> Tuple[np.ndarray, ...]:
+        batch = self.queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
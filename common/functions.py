@@ -11,6 +11,8 @@ import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import numpy as np
 
+from typing import Optional
+
 def expand_dims(x: nn.Variable, axis: int) -> nn.Variable:
     shape = list(x.shape)
     assert len(shape) >= axis >= -1
@@ -58,25 +60,26 @@ def where(condition: nn.Variable, x:nn.Variable, y: nn.Variable) -> nn.Variable:
     false_condition = F.constant(1, shape=true_condition.shape) - true_condition
     return true_condition * x + false_condition * y
 
+def logsumexp(x: nn.Variable, axis: int, keepdims: bool = False) -> nn.Variable:
+    '''
+    This function computes log(sum(exp(x))) along `axis`, subtracting the maximum to avoid overflow.
+    '''
+    axis = axis % x.ndim
+    x_max = F.max(x, axis=axis, keepdims=True)
+    ret = x_max + F.log(F.sum(F.exp(x - F.broadcast(x_max, shape=x.shape)), axis=axis, keepdims=True))
+    if not keepdims:
+        ret = F.reshape(ret, shape=[size for i, size in enumerate(x.shape) if i != axis])
+    return ret
+
 def time_distributed(func):
+    '''
+    Apply `func` to every timestep of x of a shape (batch_size, length, ...) with a single call,
+    by folding the time axis into the batch axis.
+    '''
     def time_distributed_func(x, *args, **kwargs):
-        ret = []
-        batch_size = x.shape[0]
-        length = x.shape[1]
-        dim = x.shape[2] if x.ndim > 2 else 1
-        if length > 1:
-            xs = F.split(x, axis=1)
-        else:
-            xs = [F.reshape(x, (batch_size, dim))]
-        for x_ in xs:
-            value = func(x_, *args, **kwargs)
-            _, output_dim = value.shape
-            ret.append(F.reshape(value, (batch_size, 1, output_dim)))
-        
-        if length > 1:
-            return F.concatenate(*ret, axis=1)
-        else:
-            return ret[0]
+        batch_size, length = x.shape[:2]
+        value = func(F.reshape(x, (batch_size * length, ) + tuple(x.shape[2:])), *args, **kwargs)
+        return F.reshape(value, (batch_size, length) + tuple(value.shape[1:]))
     return time_distributed_func
 
 
@@ -89,9 +92,30 @@ def time_distributed_softmax_cross_entropy(y_pred: nn.Variable, y_true: nn.Varia
     Returns:
         nn.Variable: A shape (batch_size, length).
     '''
-    ret = []
-    for y_p, y_t in zip(F.split(y_pred, axis=1), F.split(y_true, axis=1)):
-        ret.append(F.softmax_cross_entropy(y_p, y_t))
-    return F.concatenate(*ret)
+    batch_size, length, _ = y_pred.shape
+    return F.reshape(F.softmax_cross_entropy(y_pred, y_true, axis=2), (batch_size, length))
 
-    
\ No newline at end of file
+def sequence_softmax_cross_entropy(y_pred: nn.Variable, y_true: nn.Variable, mask: Optional[nn.Variable] = None,
+                                   normalize: str = 'token') -> nn.Variable:
+    '''
+    A softmax crossentropy of sequences, computed by a single softmax_cross_entropy over all timesteps.
+    Args:
+        y_pred (nnabla.Variable): A shape of (batch_size, length, number_of_outputs).
+        y_true (nnabla.Variable): A shape of (batch_size, length) or (batch_size, length, 1). # index
+        mask (nnabla.Variable): A shape of (batch_size, length) or (batch_size, length, 1). Timesteps of 0 are ignored.
+        normalize (str): 'token' averages over all (unmasked) tokens,
+                         and 'sentence' averages over tokens of each sentence, then over sentences.
+    Returns:
+        nn.Variable: A scalar loss.
+    '''
+    assert normalize in ('token', 'sentence'), f'unknown normalize: {normalize}'
+    batch_size, length, _ = y_pred.shape
+    entropy = time_distributed_softmax_cross_entropy(y_pred, F.reshape(y_true, (batch_size, length, 1)))
+    if mask is None:
+        mask = F.constant(1, shape=(batch_size, length))
+    else:
+        mask = F.reshape(mask, (batch_size, length))
+    entropy = entropy * mask
+    if normalize == 'token':
+        return F.sum(entropy) / F.sum(mask)
+    return F.mean(F.sum(entropy, axis=1) / F.sum(mask, axis=1))
@@ -8,15 +8,19 @@
 
 import nnabla as nn
 import nnabla.functions as F
+import nnabla.initializer as I
 import nnabla.parametric_functions as PF
 import numpy as np
 
+from nnabla.parameter import get_parameter_or_create
+
+from typing import Callable
 from typing import Optional
 from typing import Tuple
 
 @PF.parametric_function_api('simple_rnn')
 def simple_rnn(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = None,
-               return_sequences: bool = False, fix_parameters=False) -> nn.Variable:
+               return_sequences: bool = False, fix_parameters=False, backend: str = 'graph') -> nn.Variable:
     '''
     A vanilla recurrent neural network layer
     Args:
@@ -25,11 +29,16 @@ def simple_rnn(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = No
         mask (nnabla.Variable): A shape of [batch_size, length, 1].
         return_sequences (bool): Whether to return the last output. in the output sequence, or the full sequence.
         fix_parameters (bool): Fix parameters (Set need_grad=False).
+        backend (str): 'graph' unrolls the recurrence into the graph with an affine of [x, h] at every timestep,
+                       'hoisted' computes the input projection of all timesteps at once before the loop,
+                       and 'fused' runs `F.rnn` on the same parameters.
+                       'fused' assumes that the mask is for post-padding, which is checked under `nnabla.auto_forward`.
     Returns:
         nn.Variable: A shape [batch_size, length, units]
         or
         nn.Variable: A shape [batch_size units].
     '''
+    assert backend in ('graph', 'hoisted', 'fused'), f'unknown backend: {backend}'
 
     hs = []
     batch_size, length, embedding_size = inputs.shape
@@ -37,11 +46,20 @@ def simple_rnn(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = No
 
     h = h0
 
+    W, b = _recurrent_affine_parameters(embedding_size, units, units, fix_parameters=fix_parameters)
+
+    if backend == 'fused':
+        ys, _ = F.rnn(F.transpose(inputs, (1, 0, 2)), F.reshape(h0, (1, 1, batch_size, units)),
+                      F.reshape(F.transpose(W, (1, 0)), (1, units, embedding_size + units)), bias=F.reshape(b, (1, 1, units)))
+        return _masked_fused_outputs(F.transpose(ys, (1, 0, 2)), mask, return_sequences)
+
     if mask is None:
         mask = F.constant(1, shape=(batch_size, length, 1))
 
-    for x, cond in zip(F.split(inputs, axis=1), F.split(mask, axis=1)):
-        h_t = F.tanh(PF.affine(F.concatenate(x, h, axis=1), units, fix_parameters=fix_parameters))
+    xs, step_affine = _recurrent_affine(inputs, W, b, hoisted=backend == 'hoisted')
+
+    for x, cond in zip(F.split(xs, axis=1), F.split(mask, axis=1)):
+        h_t = F.tanh(step_affine(x, h))
         h = where(cond, h_t, h)
         hs.append(h)
 
@@ -51,9 +69,115 @@ def simple_rnn(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = No
     else:
         return hs[-1]
 
-def lstm_cell(x: nn.Variable, c: nn.Variable, h: nn.Variable) -> nn.Variable:
+def _recurrent_affine_parameters(embedding_size: int, units: int, outmaps: int,
+                                 fix_parameters: bool = False) -> Tuple[nn.Variable, nn.Variable]:
+    '''
+    Get the parameters of `PF.affine(F.concatenate(x, h, axis=1), outmaps)` in the current scope
+    (i.e. 'affine/W' and 'affine/b' initialized in the same way), so that checkpoints are compatible
+    with the per-step affine. W[:embedding_size] is for inputs and W[embedding_size:] is for hidden states.
+    Returns:
+        nn.Variable: W of a shape [embedding_size + units, outmaps].
+        nn.Variable: b of a shape [outmaps].
+    '''
+    with nn.parameter_scope('affine'):
+        w_init = I.UniformInitializer(I.calc_uniform_lim_glorot(embedding_size + units, outmaps))
+        W = get_parameter_or_create('W', (embedding_size + units, outmaps), w_init, True, not fix_parameters)
+        b = get_parameter_or_create('b', (outmaps, ), I.ConstantInitializer(), True, not fix_parameters)
+    return W, b
+
+def _recurrent_affine(inputs: nn.Variable, W: nn.Variable, b: nn.Variable,
+                      hoisted: bool = False) -> Tuple[nn.Variable, Callable[[nn.Variable, nn.Variable], nn.Variable]]:
+    '''
+    Split `F.affine(F.concatenate(x, h, axis=1), W, b)` of a recurrence into what is computed before the loop
+    and what is computed at every timestep.
+    With `hoisted`, the input projection of all timesteps is computed at once, and only h -> outmaps is left in the loop.
+    Returns:
+        nn.Variable: Inputs of the loop of a shape [batch_size, length, ...].
+        Callable: step_affine(x, h) computes the affine of a timestep from x of the inputs of the loop.
+    '''
+    embedding_size = inputs.shape[2]
+    if not hoisted:
+        def step_affine(x: nn.Variable, h: nn.Variable) -> nn.Variable:
+            return F.affine(F.concatenate(x, h, axis=1), W, b)
+        return inputs, step_affine
+
+    W_h = W[embedding_size:]
+    def hoisted_step_affine(x: nn.Variable, h: nn.Variable) -> nn.Variable:
+        return x + F.affine(h, W_h)
+    return F.affine(inputs, W[:embedding_size], b, base_axis=2), hoisted_step_affine
+
+# the order of the gates of `F.lstm` (i, f, g, o) by the indices of those of `lstm` (g, i, f, o).
+_FUSED_LSTM_GATES = [1, 2, 0, 3]
+
+def lstm_weights_to_fused(W: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert the parameters of `lstm` ('affine/W' and 'affine/b') into those of `F.lstm`.
+    Args:
+        W (numpy.ndarray): A shape of [embedding_size + units, 4 * units].
+        b (numpy.ndarray): A shape of [4 * units].
+    Returns:
+        numpy.ndarray: weight_l0 of a shape [1, 4, units, embedding_size + units].
+        numpy.ndarray: bias of a shape [1, 1, 4, units].
+    '''
+    in_units, units = W.shape[0], W.shape[1] // 4
+    weight_l0 = W.reshape(in_units, 4, units)[:, _FUSED_LSTM_GATES].transpose(1, 2, 0)[None]
+    bias = b.reshape(4, units)[_FUSED_LSTM_GATES][None, None]
+    return weight_l0, bias
+
+def fused_to_lstm_weights(weight_l0: np.ndarray, bias: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert the parameters of `F.lstm` (or `PF.lstm` with a single unidirectional layer) into those of `lstm`.
+    '''
+    _, _, units, in_units = weight_l0.shape
+    order = np.argsort(_FUSED_LSTM_GATES)
+    W = weight_l0[0][order].transpose(2, 0, 1).reshape(in_units, 4*units)
+    b = bias[0, 0][order].reshape(4*units)
+    return W, b
+
+def rnn_weights_to_fused(W: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert the parameters of `simple_rnn` into weight_l0 of a shape [1, units, embedding_size + units]
+    and bias of [1, 1, units] of `F.rnn`.
+    '''
+    return W.T[None], b[None, None]
+
+def fused_to_rnn_weights(weight_l0: np.ndarray, bias: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert the parameters of `F.rnn` into those of `simple_rnn`.
+    '''
+    return weight_l0[0].T, bias[0, 0]
+
+def _fused_lstm_parameters(W: nn.Variable, b: nn.Variable, units: int) -> Tuple[nn.Variable, nn.Variable]:
+    # the same conversion as `lstm_weights_to_fused` in the graph, so that gradients reach W and b.
+    in_units = W.shape[0]
+    W = F.concatenate(*[W[:, units*g: units*(g+1)] for g in _FUSED_LSTM_GATES], axis=1)
+    weight_l0 = F.reshape(F.transpose(F.reshape(W, (in_units, 4, units)), (1, 2, 0)), (1, 4, units, in_units))
+    bias = F.reshape(F.concatenate(*[b[units*g: units*(g+1)] for g in _FUSED_LSTM_GATES], axis=0), (1, 1, 4, units))
+    return weight_l0, bias
+
+def _masked_fused_outputs(ys: nn.Variable, mask: Optional[nn.Variable], return_sequences: bool) -> nn.Variable:
+    '''
+    Make outputs of a fused RNN the same as those of the graph backend with a post-padding mask,
+    where the state after the last valid timestep is kept until the end.
+    '''
+    batch_size, length, units = ys.shape
+    if mask is None:
+        return ys if return_sequences else F.reshape(ys[:, length-1:], (batch_size, units))
+    if nn.get_auto_forward():
+        # the fused kernels run through leading padding, so only post-padding is supported.
+        assert np.all(np.diff(mask.d.reshape(batch_size, length), axis=1) <= 0), \
+               "backend='fused' supports only post-padding masks."
+    # 1 only at the last valid timestep of each sequence.
+    next_mask = F.constant(0, shape=(batch_size, 1, 1))
+    if length > 1:
+        next_mask = F.concatenate(mask[:, 1:], next_mask, axis=1)
+    last = F.sum(ys * (mask - next_mask), axis=1)
+    if not return_sequences:
+        return last
+    return ys * mask + F.broadcast(F.reshape(last, (batch_size, 1, units)), ys.shape) * (1 - mask)
+
+def _lstm_gates(_hidden: nn.Variable, c: nn.Variable) -> Tuple[nn.Variable, nn.Variable]:
     batch_size, units = c.shape
-    _hidden = PF.affine(F.concatenate(x, h, axis=1), 4*units)
 
     a            = F.tanh   (_hidden[:, units*0: units*1])
     input_gate   = F.sigmoid(_hidden[:, units*1: units*2])
@@ -64,9 +188,15 @@ def lstm_cell(x: nn.Variable, c: nn.Variable, h: nn.Variable) -> nn.Variable:
     hidden = output_gate * F.tanh(cell)
     return cell, hidden
 
+def lstm_cell(x: nn.Variable, c: nn.Variable, h: nn.Variable) -> nn.Variable:
+    batch_size, units = c.shape
+    _hidden = PF.affine(F.concatenate(x, h, axis=1), 4*units)
+    return _lstm_gates(_hidden, c)
+
 @PF.parametric_function_api('lstm')
 def lstm(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = None, initial_state: Tuple[nn.Variable, nn.Variable] = None,
-         return_sequences: bool = False, return_state: bool = False, fix_parameters: bool = False) -> nn.Variable:
+         return_sequences: bool = False, return_state: bool = False, fix_parameters: bool = False,
+         backend: str = 'graph') -> nn.Variable:
     '''
     A long short-term memory
     Args:
@@ -77,11 +207,17 @@ def lstm(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = None, in
         return_sequences (bool): Whether to return the last output. in the output sequence, or the full sequence.
         return_state (bool): Whether to return the last state which is consist of the cell and the hidden state.
         fix_parameters (bool): Fix parameters (Set need_grad=False).
+        backend (str): 'graph' unrolls the recurrence into the graph with an affine of [x, h] at every timestep,
+                       'hoisted' computes the input projection of all timesteps at once before the loop,
+                       and 'fused' runs `F.lstm` on the same parameters.
+                       'fused' assumes that the mask is for post-padding, which is checked under `nnabla.auto_forward`,
+                       and cannot return the state with a mask.
     Returns:
         nn.Variable: A shape [batch_size, length, units].
         or
         nn.Variable: A shape [batch_size units]
     '''
+    assert backend in ('graph', 'hoisted', 'fused'), f'unknown backend: {backend}'
     
     batch_size, length, embedding_size = inputs.shape
 
@@ -107,10 +243,26 @@ def lstm(inputs: nn.Variable, units: int, mask: Optional[nn.Variable] = None, in
 
     hs = []
 
+    W, b = _recurrent_affine_parameters(embedding_size, units, 4*units, fix_parameters=fix_parameters)
+
+    if backend == 'fused':
+        # F.lstm returns the state after the last timestep, which is not the one at the end of a masked sequence.
+        assert mask is None or not return_state, "backend='fused' cannot return the state with a mask."
+        weight_l0, bias = _fused_lstm_parameters(W, b, units)
+        ys, hn, cn = F.lstm(F.transpose(inputs, (1, 0, 2)), F.reshape(h0, (1, 1, batch_size, units)),
+                            F.reshape(c0, (1, 1, batch_size, units)), weight_l0, bias=bias)
+        ret = _masked_fused_outputs(F.transpose(ys, (1, 0, 2)), mask, return_sequences)
+        if return_state:
+            return ret, F.reshape(cn, (batch_size, units)), F.reshape(hn, (batch_size, units))
+        return ret
+
     if mask is None:
         mask = F.constant(1, shape=(batch_size, length, 1))
-    for x, cond in zip(F.split(inputs, axis=1), F.split(mask, axis=1)):
-        cell_t, hidden_t = lstm_cell(x, cell, hidden)
+
+    xs, step_affine = _recurrent_affine(inputs, W, b, hoisted=backend == 'hoisted')
+
+    for x, cond in zip(F.split(xs, axis=1), F.split(mask, axis=1)):
+        cell_t, hidden_t = _lstm_gates(step_affine(x, hidden), cell)
         cell = where(cond, cell_t, cell)
         hidden = where(cond, hidden_t, hidden)
         hs.append(hidden)
@@ -14,13 +14,19 @@ import nnabla.monitor as M
 
 from nnabla.utils.data_iterator import DataIterator
 
+from common.data_iterator import Prefetcher
+
 import numpy as np
 
+import time
+
 from tqdm import tqdm
 
+from typing import Callable
 from typing import List
 from typing import Dict
 from typing import Optional
+from typing import Tuple
 from dataclasses import dataclass
 from dataclasses import field
 from pathlib import Path
@@ -37,6 +43,11 @@ class Trainer:
     metrics: Dict[str, nn.Variable] = field(default_factory=dict)
     save_path: str = 'log'
     current_epoch: int = 0
+    # graph_builder(*inputs) returns (loss, metrics) for input variables of a new shape.
+    # Graphs are built once per shape of the batches and share parameters.
+    graph_builder: Optional[Callable[..., Tuple[nn.Variable, Dict[str, nn.Variable]]]] = None
+    # the number of batches prepared in background while a step runs. 0 disables prefetching.
+    prefetch: int = 0
 
     def __post_init__(self) -> None:
         self._init_metrics()
@@ -44,16 +55,36 @@ class Trainer:
         self.monitor_series: Dict[str, M.MonitorSeries] = dict()
 
     def _init_metrics(self):
-        if len(self.metrics) == 0:
-            self.metrics['loss'] = self.loss
-        else:
-            ret: Dict[str, nn.Variable] = dict()
-            for key, value in self.metrics.items():
-                if ' ' in key:
-                    ret[key.replace(' ', '-')] = value
-                else:
-                    ret[key] = value
-            self.metrics = ret
+        self.metrics = self._normalize_metrics(self.loss, self.metrics)
+        self._graphs: Dict[Tuple[Tuple[int, ...], ...], Tuple[List[nn.Variable], nn.Variable, Dict[str, nn.Variable]]] = dict()
+        self._graphs[tuple(variable.shape for variable in self.inputs)] = (self.inputs, self.loss, self.metrics)
+
+    def _normalize_metrics(self, loss: nn.Variable, metrics: Dict[str, nn.Variable]) -> Dict[str, nn.Variable]:
+        if len(metrics) == 0:
+            metrics['loss'] = loss
+            return metrics
+        ret: Dict[str, nn.Variable] = dict()
+        for key, value in metrics.items():
+            if ' ' in key:
+                ret[key.replace(' ', '-')] = value
+            else:
+                ret[key] = value
+        return ret
+
+    def _get_graph(self, data: Tuple[np.ndarray, ...]) -> Tuple[List[nn.Variable], nn.Variable, Dict[str, nn.Variable]]:
+        if self.graph_builder is None:
+            return self.inputs, self.loss, self.metrics
+        key = tuple(d.shape for d in data)
+        if key not in self._graphs:
+            inputs = [nn.Variable(shape) for shape in key]
+            loss, metrics = self.graph_builder(*inputs)
+            self._graphs[key] = (inputs, loss, self._normalize_metrics(loss, metrics))
+        return self._graphs[key]
+
+    def _num_batch(self, iterator: DataIterator) -> int:
+        if hasattr(iterator, 'num_batch'):
+            return iterator.num_batch
+        return iterator.size // iterator.batch_size
         
     def update_variables(self, inputs: List[nn.Variable], loss: nn.Variable,
                          metrics: Dict[str, nn.Variable] = {}) -> None:
@@ -70,18 +101,19 @@ class Trainer:
             assert len(valid_iter.variables) == len(self.inputs), \
                   'the number of varibales received from iterator must be equal to the number of input variables'
 
-        batch_size = self.inputs[0].shape[0]
-        assert train_iter.batch_size == batch_size
-        if valid_iter is not None:
-            assert valid_iter.batch_size == batch_size
+        if self.graph_builder is None:
+            batch_size = self.inputs[0].shape[0]
+            assert train_iter.batch_size == batch_size
+            if valid_iter is not None:
+                assert valid_iter.batch_size == batch_size
 
-        num_train_batch = train_iter.size // batch_size
+        num_train_batch = self._num_batch(train_iter)
         for epoch in range(self.current_epoch, epochs+self.current_epoch):
             epoch_result = self._run_one_epoch(num_train_batch, epoch, train_iter, train=True)
             self.save_result(epoch_result)
 
             if valid_iter is not None:
-                num_valid_batch = valid_iter.size // batch_size
+                num_valid_batch = self._num_batch(valid_iter)
                 epoch_result = self._run_one_epoch(num_valid_batch, epoch, valid_iter, train=False, show_epoch=False)
                 self.save_result(epoch_result)
 
@@ -102,10 +134,11 @@ class Trainer:
     def evaluate(self, valid_iter: DataIterator, verbose=0) -> None:
         assert len(valid_iter.variables) == len(self.inputs)
 
-        batch_size = self.inputs[0].shape[0]
-        assert valid_iter.batch_size == batch_size
+        if self.graph_builder is None:
+            batch_size = self.inputs[0].shape[0]
+            assert valid_iter.batch_size == batch_size
 
-        num_valid_batch = valid_iter.size // batch_size
+        num_valid_batch = self._num_batch(valid_iter)
         epoch_result = self._run_one_epoch(num_valid_batch, self.current_epoch-1, valid_iter, train=False, show_epoch=False)
         self.save_result(epoch_result, evaluate=True)
         self.save_fig()
@@ -143,41 +176,53 @@ class Trainer:
     def _run_one_epoch(self, num_batch:int, epoch: int, iterator: DataIterator,
                        train: bool, show_epoch=True) -> Dict[str, float]:
         metrics_logger: Dict[str, List[float]] = self._init_metrics_logger()
+        # metrics are averaged over samples, since batches may differ in size (e.g. with BucketIterator).
+        batch_sizes: List[int] = []
+        data_wait_time = 0.0
+        if self.prefetch > 0:
+            iterator = Prefetcher(iterator, num_batch, depth=self.prefetch)
         
         with tqdm(total=num_batch, leave=False) as progress:
             for i in range(num_batch):
                 # set data to variable
-                for variable, data in zip(self.inputs, iterator.next()):
-                    variable.d = data
-                
-                for metric in list(self.metrics.values()):
-                    metric.forward()
+                start = time.perf_counter()
+                data = iterator.next()
+                data_wait_time += time.perf_counter() - start
+                inputs, loss, metrics = self._get_graph(data)
+                for variable, d in zip(inputs, data):
+                    variable.d = d
+                batch_sizes.append(len(data[0]))
+
+                for key, metric in metrics.items():
+                    metric.forward(clear_buffer=not train)
+                    # copy before the forward of another metric clears it as an intermediate buffer.
+                    metrics_logger[key].append(metric.d.copy())
                 
                 if train:
                     loss_forward = True
-                    for metric in list(self.metrics.values()):
-                        if metric is self.loss:
+                    for metric in list(metrics.values()):
+                        if metric is loss:
                             loss_forward = False
                     if loss_forward:
-                        self.loss.forward()
+                        loss.forward()
                     self.solver.zero_grad()
-                    self.loss.backward()
+                    loss.backward(clear_buffer=True)
                     self.solver.update()
                 
-                for key in self.metrics:
-                    metrics_logger[key].append(self.metrics[key].d.copy())
-                
                 description_list = []
                 if show_epoch:
                     description_list.append(f"epoch: {epoch+1}")
                 for key in self.metrics:
-                    description_list.append(f"{'train' if train else 'valid'} {key}: {np.mean(metrics_logger[key]):.5f}")
+                    description_list.append(f"{'train' if train else 'valid'} {key}: {np.average(metrics_logger[key], weights=batch_sizes):.5f}")
+                description_list.append(f"data wait: {data_wait_time:.1f}s")
                 progress.set_description(', '.join(description_list))
                 progress.update(1)
         
         epoch_result: Dict[str, float] = dict()
         for metric in metrics_logger:
-            epoch_result[metric + '-' + ('train' if train else 'valid')] = np.mean(metrics_logger[metric])
+            epoch_result[metric + '-' + ('train' if train else 'valid')] = np.average(metrics_logger[metric], weights=batch_sizes)
+        # seconds spent waiting for data in this epoch.
+        epoch_result['data-wait-' + ('train' if train else 'valid')] = data_wait_time
 
         return epoch_result
 
@@ -6,12 +6,26 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
+from collections import Counter
+from itertools import chain
 from pathlib import Path
+from typing import BinaryIO
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
 from typing import Tuple
 from typing import Dict
+from typing import Union
 from dataclasses import dataclass
 from dataclasses import field
 
@@ -20,27 +34,464 @@ from nnabla.utils.data_source_loader import load_npy
 from nnabla.utils.data_source_loader import get_data_home
 
 
-def with_padding(sequences: List[List[int]], padding_type: str = 'post',
-                 max_sequence_length: int = 0) -> np.ndarray:
-    if max_sequence_length == 0:
-        max_sequence_length = max(map(lambda x: len(x), sequences))
+def to_flat(sequences: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if len(sequences) > 0 and isinstance(sequences[0], np.ndarray):
+        tokens = np.concatenate(sequences).astype(np.int32, copy=False)
     else:
+        tokens = np.fromiter(chain.from_iterable(sequences), dtype=np.int32, count=offsets[-1])
+    return tokens, offsets
+
+
+@dataclass(eq=False)
+class Corpus(object):
+    '''
+    A corpus stored as one flat token array and sentence offsets.
+    The i-th sentence is tokens[offsets[i]:offsets[i+1]], and is returned as a view.
+    Args:
+        tokens (numpy.ndarray): A shape of (number_of_tokens, ).
+        offsets (numpy.ndarray): A shape of (number_of_sentences + 1, ).
+    '''
+    tokens: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def from_sequences(cls, sequences: List[List[int]]) -> 'Corpus':
+        return cls(*to_flat(sequences))
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for start, end in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            yield self.tokens[start:end]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('corpus index out of range')
+            return self.tokens[self.offsets[index]:self.offsets[index+1]]
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                offsets = self.offsets[start:max(start, stop)+1]
+                return Corpus(self.tokens[offsets[0]:offsets[-1]], offsets - offsets[0])
+            index = np.arange(start, stop, step)
+
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        starts = self.offsets[:-1][index]
+        lengths = self.offsets[1:][index] - starts
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        return Corpus(self.tokens[positions], offsets)
+
+
+def pad_flat(tokens: np.ndarray, offsets: np.ndarray, padding_type: str = 'post',
+             max_sequence_length: int = 0) -> np.ndarray:
+    '''
+    Pad sequences given as a flat token array and its offsets into a preallocated matrix.
+    Args:
+        tokens (numpy.ndarray): A shape of (number_of_tokens, ).
+        offsets (numpy.ndarray): A shape of (number_of_sequences + 1, ). The i-th sequence is tokens[offsets[i]:offsets[i+1]].
+        padding_type (str): 'post' or 'pre'.
+        max_sequence_length (int): Sequences longer than this are truncated. 0 means the longest length.
+    Returns:
+        numpy.ndarray: A shape (number_of_sequences, max_sequence_length).
+    '''
+    if padding_type not in ('post', 'pre'):
+        raise Exception('padding type error. padding type must be "post" or "pre"')
+
+    starts = np.asarray(offsets[:-1], dtype=np.int64)
+    lengths = np.diff(offsets)
+    if max_sequence_length == 0:
+        max_sequence_length = int(lengths.max()) if len(lengths) > 0 else 0
+    lengths = np.minimum(lengths, max_sequence_length)
+
+    padded = np.zeros((len(lengths), max_sequence_length), dtype=np.int32)
+
+    # rows of the same length are filled together with a single gather.
+    order = np.argsort(lengths, kind='stable')
+    boundaries = np.flatnonzero(np.diff(lengths[order])) + 1
+    for rows in np.split(order, boundaries):
+        if len(rows) == 0:
+            continue
+        length = lengths[rows[0]]
+        if length == 0:
+            continue
+        columns = slice(0, length) if padding_type == 'post' else slice(max_sequence_length-length, max_sequence_length)
+        # bound the size of the temporary index array.
+        chunk_size = max(1, (1 << 18) // length)
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i+chunk_size]
+            padded[chunk, columns] = tokens[starts[chunk, None] + np.arange(length)]
+    return padded
+
+
+def with_padding(sequences: Union[Corpus, List[List[int]]], padding_type: str = 'post',
+                 max_sequence_length: int = 0) -> np.ndarray:
+    if max_sequence_length != 0:
         assert type(max_sequence_length) == int, 'max_sequence_length must be an integer.'
         assert max_sequence_length > 0, 'max_sequence_length must be a positive integer.'
 
-    def _with_padding(sequence: List[int]) -> np.ndarray:
-        sequence = sequence[:max_sequence_length]
-        sequence_length = len(sequence)
-        pad_length = max_sequence_length - sequence_length
-        if padding_type == 'post':
-            return sequence + [0] * pad_length
-        elif padding_type == 'pre':
-            return [0] * pad_length + sequence
+    if isinstance(sequences, Corpus):
+        tokens, offsets = sequences.tokens, sequences.offsets
+    else:
+        tokens, offsets = to_flat(sequences)
+    return pad_flat(tokens, offsets, padding_type=padding_type, max_sequence_length=max_sequence_length)
+
+
+def unigram_distribution(sentences: Union[Corpus, List[List[int]]], power: float = 1.0,
+                         chunk_size: int = 1 << 22) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Compute the unigram distribution raised to `power` (and renormalized).
+    Tokens are counted chunk by chunk, so memory does not grow with the corpus.
+    Returns:
+        numpy.ndarray: Words in order of their first occurrence.
+        numpy.ndarray: The probability of each word.
+    '''
+    tokens = sentences.tokens if isinstance(sentences, Corpus) else to_flat(sentences)[0]
+    counts = np.zeros(0, dtype=np.int64)
+    first_positions = np.zeros(0, dtype=np.int64)
+    for start in range(0, len(tokens), chunk_size):
+        chunk = np.asarray(tokens[start:start+chunk_size])
+        chunk_counts = np.bincount(chunk)
+        if len(chunk_counts) > len(counts):
+            grow = len(chunk_counts) - len(counts)
+            counts = np.concatenate([counts, np.zeros(grow, dtype=np.int64)])
+            first_positions = np.concatenate([first_positions, np.full(grow, len(tokens), dtype=np.int64)])
+        # only words which have not appeared yet need their first positions.
+        if np.any((chunk_counts > 0) & (counts[:len(chunk_counts)] == 0)):
+            chunk_words, index = np.unique(chunk, return_index=True)
+            first_positions[chunk_words] = np.minimum(first_positions[chunk_words], start + index)
+        counts[:len(chunk_counts)] += chunk_counts
+
+    words = np.flatnonzero(counts)
+    words = words[np.argsort(first_positions[words], kind='stable')]
+    prob = counts[words] / np.sum(counts)
+    prob = np.power(prob, power)
+    return words.astype(np.int32), prob / np.sum(prob)
+
+
+def subsample(corpus: Corpus, words: np.ndarray, frequencies: np.ndarray, threshold: float = 1e-4,
+              rng: Optional[np.random.RandomState] = None, chunk_size: int = 1 << 22) -> Corpus:
+    '''
+    Drop frequent words at random like word2vec. A word of frequency f is kept
+    with probability min(1, sqrt(threshold / f) + threshold / f), so call this every epoch
+    to draw a different subsample. The keep mask is drawn chunk by chunk,
+    so only the kept tokens take memory in proportion to the corpus.
+    Args:
+        corpus (Corpus): Sentences.
+        words (numpy.ndarray): Words, e.g. from `unigram_distribution`.
+        frequencies (numpy.ndarray): The unigram frequency of each word.
+        threshold (float): Words more frequent than about this are subsampled.
+        rng (numpy.random.RandomState): A random number generator.
+        chunk_size (int): The number of tokens processed at once.
+    Returns:
+        Corpus: Subsampled sentences.
+    '''
+    tokens, offsets = corpus.tokens, np.asarray(corpus.offsets)
+    keep_prob = np.ones(int(np.max(words, initial=0)) + 1)
+    ratio = threshold / np.asarray(frequencies)
+    keep_prob[words] = np.minimum(np.sqrt(ratio) + ratio, 1.0)
+
+    random = rng.random_sample if rng is not None else np.random.random_sample
+    kept_tokens = []
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    num_kept = 0
+    for start in range(0, len(tokens), chunk_size):
+        chunk = np.asarray(tokens[start:start+chunk_size])
+        # words which are not in `words` are always kept.
+        prob = np.ones(len(chunk))
+        known = chunk < len(keep_prob)
+        prob[known] = keep_prob[chunk[known]]
+        keep = random(len(chunk)) < prob
+        kept_tokens.append(chunk[keep])
+
+        # the number of kept tokens before each sentence boundary in this chunk.
+        kept_before = np.zeros(len(chunk) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept_before[1:])
+        lo, hi = np.searchsorted(offsets, [start, start + len(chunk)])
+        new_offsets[lo:hi] = num_kept + kept_before[offsets[lo:hi] - start]
+        num_kept += int(kept_before[-1])
+    new_offsets[np.searchsorted(offsets, len(tokens)):] = num_kept
+    tokens = np.concatenate(kept_tokens) if len(kept_tokens) > 0 else np.zeros(0, dtype=np.asarray(tokens[:0]).dtype)
+    return Corpus(tokens, new_offsets)
+
+
+class DatasetWriter(object):
+    '''
+    Write a dataset in the format of `save_dataset` incrementally, so that a dataset
+    larger than memory is written chunk by chunk. Chunks appended to a column are
+    concatenated along the first axis. The directory appears atomically on `close`.
+    Args:
+        path (pathlib.Path): A directory to be created.
+    '''
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = Path(tempfile.mkdtemp(dir=self.path.parent, prefix=f'.{self.path.name}-'))
+        self._files: Dict[str, BinaryIO] = dict()
+        self._meta: Dict[str, Dict] = dict()
+
+    def append(self, name: str, chunk: np.ndarray) -> None:
+        chunk = np.ascontiguousarray(chunk)
+        if name not in self._files:
+            self._files[name] = open(self._tmp_path / f'{name}.bin', 'wb')
+            self._meta[name] = dict(dtype=chunk.dtype.str, shape=[0] + list(chunk.shape[1:]))
+        meta = self._meta[name]
+        assert chunk.dtype.str == meta['dtype'] and list(chunk.shape[1:]) == meta['shape'][1:], \
+            f'a chunk of {chunk.dtype.str}{chunk.shape} cannot be appended to the column {name}.'
+        chunk.tofile(self._files[name])
+        meta['shape'][0] += len(chunk)
+
+    def close(self, vocab: Dict[str, List[str]] = {}) -> None:
+        for f in self._files.values():
+            f.close()
+        with open(self._tmp_path / 'meta.json', 'w') as f:
+            json.dump(self._meta, f)
+        with open(self._tmp_path / 'vocab.json', 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        try:
+            os.replace(self._tmp_path, self.path)
+        except OSError:
+            # another process has already written the same dataset.
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+def save_dataset(path: Path, columns: Dict[str, np.ndarray], vocab: Dict[str, List[str]] = {}) -> None:
+    '''
+    Save a dataset into the directory `path` in a columnar binary format, which is
+    written once and opened with `open_dataset` as memory maps.
+    Each column is a raw `<name>.bin` file (e.g. tokens, offsets and labels of a split),
+    `meta.json` holds their dtypes and shapes, and `vocab.json` holds the vocabularies.
+    The directory appears atomically, so a partially written dataset is never opened.
+    Args:
+        path (pathlib.Path): A directory to be created.
+        columns (Dict[str, numpy.ndarray]): Arrays saved as columns.
+        vocab (Dict[str, List[str]]): Vocabularies, e.g. {'words': [...]} whose i-th element is the word of id i.
+    '''
+    writer = DatasetWriter(path)
+    for name, column in columns.items():
+        writer.append(name, np.asarray(column))
+    writer.close(vocab)
+
+
+def open_dataset(path: Path) -> Tuple[Dict[str, np.ndarray], Dict[str, List[str]]]:
+    '''
+    Open a dataset saved by `save_dataset`. Columns are read-only `numpy.memmap`s,
+    so processes opening the same dataset share its pages through the OS page cache.
+    Returns:
+        Dict[str, numpy.ndarray]: Columns.
+        Dict[str, List[str]]: Vocabularies.
+    '''
+    path = Path(path)
+    with open(path / 'meta.json') as f:
+        meta = json.load(f)
+    columns: Dict[str, np.ndarray] = dict()
+    for name, info in meta.items():
+        shape = tuple(info['shape'])
+        if np.prod(shape) == 0:
+            # an empty file cannot be mapped.
+            columns[name] = np.zeros(shape, dtype=info['dtype'])
         else:
-            raise Exception('padding type error. padding type must be "post" or "pre"')
-
-    return np.array(list(map(_with_padding, sequences)), dtype=np.int32)
-
+            columns[name] = np.memmap(path / f'{name}.bin', dtype=info['dtype'], mode='r', shape=shape)
+    with open(path / 'vocab.json', encoding='utf-8') as f:
+        vocab = json.load(f)
+    return columns, vocab
+
+
+def dataset_dir(name: str) -> Path:
+    return Path(get_data_home()) / 'datasets' / name
+
+
+def iter_lines(f: BinaryIO, encoding: str = 'utf-8') -> Iterator[str]:
+    '''
+    Read lines of a binary file object one by one, without loading the whole file.
+    Only '\\n' separates lines, and it is kept at the end of each line.
+    '''
+    yield from io.TextIOWrapper(f, encoding=encoding, newline='\n')
+
+
+def count_words(lines: Iterable[str]) -> Counter:
+    '''
+    Count words of whitespace-separated lines. This is the first pass of the two-pass vocabulary building.
+    '''
+    counter: Counter = Counter()
+    for line in lines:
+        counter.update(line.split())
+    return counter
+
+
+def build_vocab(counter: Counter, min_freq: int = 1,
+                reserved: List[str] = ['pad', '<eos>', '<unk>']) -> Tuple[Dict[str, int], Dict[int, str]]:
+    '''
+    Build a vocabulary of the words which occur at least `min_freq` times, in descending order of frequency.
+    Returns:
+        Dict[str, int]: w2i, whose first ids are the `reserved` words.
+        Dict[int, str]: i2w.
+    '''
+    w2i: Dict[str, int] = dict()
+    for word in reserved:
+        w2i.setdefault(word, len(w2i))
+    for word, count in counter.most_common():
+        if count < min_freq:
+            break
+        w2i.setdefault(word, len(w2i))
+    return w2i, {i: w for w, i in w2i.items()}
+
+
+def encode_lines(lines: Iterable[str], w2i: Dict[str, int], i2w: Optional[Dict[int, str]] = None,
+                 unk: Optional[int] = None, bos: Optional[int] = None, eos: Optional[int] = None,
+                 chunk_size: int = 1 << 20) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    '''
+    Encode lines of whitespace-separated words into id arrays chunk by chunk,
+    so that only a chunk of ids is in memory at once.
+    A line without a trailing '\\n' (i.e. an unterminated last line) is not emitted.
+    Args:
+        lines (Iterable[str]): Lines, e.g. from `iter_lines`.
+        w2i (Dict[str, int]): A vocabulary.
+        i2w (Dict[int, str]): If given, unknown words are added to `w2i` and `i2w` (single-pass mode).
+        unk (int): An id of unknown words when `i2w` is not given.
+        bos (int): An id prepended to every sentence.
+        eos (int): An id appended to every sentence.
+        chunk_size (int): The approximate number of tokens in a chunk.
+    Returns:
+        Iterator[Tuple[numpy.ndarray, numpy.ndarray]]: int32 tokens and int64 lengths of the sentences in a chunk.
+    '''
+    assert i2w is not None or unk is not None, 'either i2w or unk must be given.'
+    tokens: List[int] = []
+    lengths: List[int] = []
+    for line in lines:
+        words = line.split()
+        if i2w is not None:
+            for word in words:
+                if word not in w2i:
+                    w2i[word] = len(w2i)
+                    i2w[w2i[word]] = word
+            ids = [w2i[word] for word in words]
+        else:
+            ids = [w2i.get(word, unk) for word in words]
+        if not line.endswith('\n'):
+            continue
+        if bos is not None:
+            tokens.append(bos)
+        tokens.extend(ids)
+        if eos is not None:
+            tokens.append(eos)
+        lengths.append(len(ids) + (bos is not None) + (eos is not None))
+        if len(tokens) >= chunk_size:
+            yield np.array(tokens, dtype=np.int32), np.array(lengths, dtype=np.int64)
+            tokens, lengths = [], []
+    if len(lengths) > 0:
+        yield np.array(tokens, dtype=np.int32), np.array(lengths, dtype=np.int64)
+
+
+def chunks_to_corpus(chunks: Iterable[Tuple[np.ndarray, np.ndarray]]) -> Corpus:
+    tokens, lengths = [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.int64)]
+    for chunk_tokens, chunk_lengths in chunks:
+        tokens.append(chunk_tokens)
+        lengths.append(chunk_lengths)
+    lengths = np.concatenate(lengths)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return Corpus(np.concatenate(tokens), offsets)
+
+
+def _open_text(source: str) -> BinaryIO:
+    if source.startswith(('http://', 'https://')):
+        return download(source, open_file=True)
+    return open(source, 'rb')
+
+
+def load_text_corpus(sources: Dict[str, str], min_freq: int = 1, with_bos: bool = False,
+                     chunk_size: int = 1 << 20, use_cache: bool = True) -> Tuple[Dict[str, Corpus], Dict[str, int], Dict[int, str]]:
+    '''
+    Load text corpora of one sentence per line which may be larger than memory.
+    The vocabulary is built from the 'train' split in a first pass (words less frequent than
+    `min_freq` become '<unk>'), then every split is encoded in a second pass and streamed
+    into a dataset of `save_dataset` format, which is opened as memory maps.
+    Every sentence ends with '<eos>' like `PTBDataset`.
+    Args:
+        sources (Dict[str, str]): Paths or URLs of splits, e.g. {'train': ..., 'valid': ...}. 'train' is required.
+        min_freq (int): The minimum frequency of words in the vocabulary.
+        with_bos (bool): Whether to prepend '<bos>' to every sentence.
+        chunk_size (int): The approximate number of tokens encoded at once.
+        use_cache (bool): Whether to reuse the dataset written before.
+    Returns:
+        Dict[str, Corpus]: Corpora of the splits.
+        Dict[str, int]: w2i.
+        Dict[int, str]: i2w.
+    '''
+    key = f'{sorted(sources.items())}|min_freq={min_freq}|with_bos={with_bos}'
+    cache_dir = dataset_dir(f'text-{hashlib.md5(key.encode("utf-8")).hexdigest()}')
+    if not (use_cache and cache_dir.exists()):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        with _open_text(sources['train']) as f:
+            counter = count_words(iter_lines(f))
+        reserved = ['pad', '<eos>', '<unk>'] + (['<bos>'] if with_bos else [])
+        w2i, i2w = build_vocab(counter, min_freq=min_freq, reserved=reserved)
+        del counter
+
+        writer = DatasetWriter(cache_dir)
+        for name, source in sources.items():
+            total = 0
+            writer.append(f'{name}_offsets', np.zeros(1, dtype=np.int64))
+            writer.append(f'{name}_tokens', np.zeros(0, dtype=np.int32))
+            with _open_text(source) as f:
+                for tokens, lengths in encode_lines(iter_lines(f), w2i, unk=w2i['<unk>'], eos=w2i['<eos>'],
+                                                    bos=w2i['<bos>'] if with_bos else None, chunk_size=chunk_size):
+                    writer.append(f'{name}_tokens', tokens)
+                    writer.append(f'{name}_offsets', total + np.cumsum(lengths))
+                    total += len(tokens)
+        writer.close(dict(words=[i2w[i] for i in range(len(i2w))]))
+
+    columns, vocab = open_dataset(cache_dir)
+    w2i = {word: i for i, word in enumerate(vocab['words'])}
+    i2w = {i: word for i, word in enumerate(vocab['words'])}
+    corpora = {name: Corpus(columns[f'{name}_tokens'], columns[f'{name}_offsets']) for name in sources}
+    return corpora, w2i, i2w
+
+
+def encode_words(words: List[str], c2i: Dict[str, int], word_length: int = 20) -> np.ndarray:
+    '''
+    Encode words into char ids padded with 0 up to `word_length`. Chars not in `c2i`
+    become the id of '<unk>', which `c2i` must have, so that words out of vocabulary
+    (e.g. at inference time) can be encoded without being confused with padding.
+    Returns:
+        numpy.ndarray: A shape of (len(words), word_length).
+    '''
+    assert '<unk>' in c2i, "c2i must have '<unk>' for unknown chars."
+    unk = c2i['<unk>']
+    table = np.zeros((len(words), word_length), dtype=np.int32)
+    for i, word in enumerate(words):
+        chars = [c2i.get(char, unk) for char in word[:word_length]]
+        table[i, :len(chars)] = chars
+    return table
+
+
+def build_char_table(i2w: Dict[int, str], c2i: Dict[str, int], word_length: int = 20) -> np.ndarray:
+    '''
+    Build a lookup table from word ids to char ids, so that a word id sequence is
+    encoded into char id sequences by a single gather `char_table[data]`.
+    The row of 'pad' (id 0) is all 0.
+    Returns:
+        numpy.ndarray: A shape of (vocab_size, word_length).
+    '''
+    char_table = encode_words([i2w[i] for i in range(len(i2w))], c2i, word_length=word_length)
+    char_table[0] = 0
+    return char_table
 
 
 @dataclass
@@ -52,6 +503,7 @@ class PTBDataset(object):
     i2w: Dict[int, str] = field(default_factory=dict)
     c2i: Dict[str, int] = field(default_factory=dict)
     i2c: Dict[int, str] = field(default_factory=dict)
+    use_cache: bool = True
 
     def __post_init__(self) -> None:       
         self.w2i['pad'] = 0
@@ -59,76 +511,121 @@ class PTBDataset(object):
         self.w2i['<eos>'] = 1
         self.i2w[1] = '<eos>'
 
+        # char id 0 is for padding (words never contain ' '), and 1 is for unknown chars.
         self.c2i[' '] = 0
         self.i2c[0] = ' '
+        self.c2i['<unk>'] = 1
+        self.i2c[1] = '<unk>'
 
         if self.with_bos:
             self.w2i['<bos>'] = 2
             self.i2w[2] = '<bos>'
 
         self.ptb_url = 'https://raw.githubusercontent.com/wojzaremba/lstm/master/data/ptb.{0}.txt'
-        
-        self.train_data: List[List[int]] = self._load_data('train')
-        self.valid_data: List[List[int]] = self._load_data('valid')
-        self.test_data: List[List[int]] = self._load_data('test')
 
-    def _load_data(self, type_name: str) -> List[List[int]]:
+        cache_dir = self._cache_dir()
+        if self.use_cache and cache_dir.exists():
+            self._load_cache(cache_dir)
+            return
+
+        self.train_data: Corpus = self._load_data('train')
+        self.valid_data: Corpus = self._load_data('valid')
+        self.test_data: Corpus = self._load_data('test')
+        if self.return_char_info:
+            self.char_table: np.ndarray = build_char_table(self.i2w, self.c2i, self.word_length)
+
+        if self.use_cache:
+            self._save_cache(cache_dir)
+
+    def _cache_dir(self) -> Path:
+        key = f'{self.ptb_url}|with_bos={self.with_bos}|return_char_info={self.return_char_info}|word_length={self.word_length}'
+        if self.return_char_info:
+            # caches made before '<unk>' was reserved have different char ids.
+            key += '|unk_char=True'
+        return dataset_dir(f'ptb-{hashlib.md5(key.encode("utf-8")).hexdigest()}')
+
+    def _save_cache(self, cache_dir: Path) -> None:
+        columns: Dict[str, np.ndarray] = dict()
+        vocab: Dict[str, List[str]] = dict()
+        vocab['words'] = [self.i2w[i] for i in range(len(self.i2w))]
+        if self.return_char_info:
+            vocab['chars'] = [self.i2c[i] for i in range(len(self.i2c))]
+            columns['char_table'] = self.char_table
+        for type_name in ['train', 'valid', 'test']:
+            corpus: Corpus = getattr(self, f'{type_name}_data')
+            columns[f'{type_name}_tokens'] = corpus.tokens
+            columns[f'{type_name}_offsets'] = corpus.offsets
+        save_dataset(cache_dir, columns, vocab)
+
+    def _load_cache(self, cache_dir: Path) -> None:
+        columns, vocab = open_dataset(cache_dir)
+        for i, word in enumerate(vocab['words']):
+            self.w2i[word] = i
+            self.i2w[i] = word
+        if self.return_char_info:
+            for i, char in enumerate(vocab['chars']):
+                self.c2i[char] = i
+                self.i2c[i] = char
+            self.char_table = columns['char_table']
+        for type_name in ['train', 'valid', 'test']:
+            setattr(self, f'{type_name}_data', Corpus(columns[f'{type_name}_tokens'], columns[f'{type_name}_offsets']))
+
+    def _load_data(self, type_name: str) -> Corpus:
         url = self.ptb_url.format(type_name)
+        chars = set()
+
+        def _lines() -> Iterator[str]:
+            for line in iter_lines(f):
+                if self.return_char_info:
+                    chars.update(line.rstrip('\n'))
+                    if line.endswith('\n'):
+                        chars.update('<eos>')
+                yield line
+
+        # every sentence ends with '<eos>'. an unterminated last line is dropped.
         with download(url, open_file=True) as f:
-            lines: str = f.read().decode('utf-8').replace('\n', '<eos>')
-
-            if self.return_char_info:
-                for char in set(lines):
-                    if char not in self.c2i:
-                        self.c2i[char] = len(self.c2i)
-                    if self.c2i[char] not in self.i2c:
-                        self.i2c[self.c2i[char]] = char
-
-            words = lines.strip().split()
-        dataset = np.ndarray((len(words), ), dtype=np.int32)
-
-        for i, word in enumerate(words):
-            if word not in self.w2i:
-                self.w2i[word] = len(self.w2i)
-            if self.w2i[word] not in self.i2w:
-                self.i2w[self.w2i[word]] = word
-            dataset[i] = self.w2i[word]
-
-        sentences = []
-        sentence = []
-        if self.with_bos:
-            sentence.append(self.w2i['<bos>'])
-        for index in dataset:
-            if self.i2w[index] != '<eos>':
-                sentence.append(index)
-            else:
-                sentence.append(index)
-                sentences.append(sentence)
-                sentence = []
-                if self.with_bos:
-                    sentence.append(self.w2i['<bos>'])
-        return sentences
+            corpus = chunks_to_corpus(encode_lines(_lines(), self.w2i, self.i2w, eos=self.w2i['<eos>'],
+                                                   bos=self.w2i['<bos>'] if self.with_bos else None))
 
+        for char in chars:
+            if char not in self.c2i:
+                self.c2i[char] = len(self.c2i)
+            if self.c2i[char] not in self.i2c:
+                self.i2c[self.c2i[char]] = char
+        return corpus
 
-def load_imdb(vocab_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-    file_name = 'imdb.npz'
-    url = f'https://s3.amazonaws.com/text-datasets/{file_name}'
-    download(url, open_file=False)
 
-    dataset_path = Path(get_data_home()) / file_name
+def load_imdb(vocab_size: int, use_cache: bool = True) -> Tuple[Corpus, Corpus, np.ndarray, np.ndarray]:
+    cache_dir = dataset_dir(f'imdb-vocab_size_{vocab_size}')
+    if use_cache and cache_dir.exists():
+        ret, _ = open_dataset(cache_dir)
+    else:
+        file_name = 'imdb.npz'
+        url = f'https://s3.amazonaws.com/text-datasets/{file_name}'
+        download(url, open_file=False)
+
+        dataset_path = Path(get_data_home()) / file_name
+
+        unk_index = vocab_size - 1
+        raw = load_npy(dataset_path)
+        ret = dict()
+        for k, v in raw.items():
+            if 'x' in k:
+                tokens, offsets = to_flat(v)
+                np.minimum(tokens, unk_index, out=tokens)
+                ret[f'{k}_tokens'] = tokens
+                ret[f'{k}_offsets'] = offsets
+            else:
+                ret[k] = v
+        if use_cache:
+            save_dataset(cache_dir, ret)
 
-    unk_index = vocab_size - 1
-    raw = load_npy(dataset_path)
-    ret = dict()
-    for k, v in raw.items():
-        if 'x' in k:
-            for i, sentence in enumerate(v):
-                v[i] = [word if word < unk_index else unk_index for word in sentence]
-        ret[k] = v
-    return ret['x_train'], ret['x_test'], ret['y_train'], ret['y_test']
+    x_train = Corpus(ret['x_train_tokens'], ret['x_train_offsets'])
+    x_test = Corpus(ret['x_test_tokens'], ret['x_test_offsets'])
+    return x_train, x_test, ret['y_train'], ret['y_test']
 
 
-def load_enja_parallel_data(lang: str):
+def load_enja_parallel_data(lang: str, use_cache: bool = True):
     url = 'https://raw.githubusercontent.com/odashi/small_parallel_enja/master/{0}.{1}'
     data_types = ['train', 'dev', 'test']
     url_list = [url.format(data_type, lang) for data_type in data_types]
@@ -136,6 +633,15 @@ def load_enja_parallel_data(lang: str):
     w2i = {}
     i2w = {}
 
+    cache_dir = dataset_dir(f'small_parallel_enja-{lang}')
+    if use_cache and cache_dir.exists():
+        columns, vocab = open_dataset(cache_dir)
+        for i, word in enumerate(vocab['words']):
+            w2i[word] = i
+            i2w[i] = word
+        corpora = [Corpus(columns[f'{data_type}_tokens'], columns[f'{data_type}_offsets']) for data_type in data_types]
+        return corpora + [w2i, i2w]
+
     w2i['pad'] = 0
     i2w[0] = 'pad'
     w2i['<bos>'] = 1
@@ -143,29 +649,18 @@ def load_enja_parallel_data(lang: str):
     w2i['<eos>'] = 2
     i2w[2] = '<eos>'
 
-    def _load_data(url: str):
+    def _load_data(url: str) -> Corpus:
+        # '<eos>' is not included in sentences. an unterminated last line is dropped.
         with download(url, open_file=True) as f:
-            lines = f.read().decode('utf-8').replace('\n', ' <eos> ')
-            words = lines.strip().split()
-        dataset = np.ndarray((len(words), ), dtype=np.int32)
-
-        for i, word in enumerate(words):
-            if word not in w2i:
-                w2i[word] = len(w2i)
-            if w2i[word] not in i2w:
-                i2w[w2i[word]] = word
-            dataset[i] = w2i[word]
-
-        sentences = []
-        sentence = []
-        for index in dataset:
-            if i2w[index] != '<eos>':
-                sentence.append(index)
-            else:
-                sentences.append(sentence)
-                sentence = []
-        return sentences
-
-    return list(map(_load_data, url_list)) + [w2i, i2w]
+            return chunks_to_corpus(encode_lines(iter_lines(f), w2i, i2w))
+
+    corpora = list(map(_load_data, url_list))
+    if use_cache:
+        columns: Dict[str, np.ndarray] = dict()
+        for data_type, corpus in zip(data_types, corpora):
+            columns[f'{data_type}_tokens'] = corpus.tokens
+            columns[f'{data_type}_offsets'] = corpus.offsets
+        save_dataset(cache_dir, columns, dict(words=[i2w[i] for i in range(len(i2w))]))
+    return corpora + [w2i, i2w]
 
 
@@ -17,20 +17,19 @@ import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 
 from common.parametric_functions import lstm
 from common.functions import time_distributed
-from common.functions import time_distributed_softmax_cross_entropy
+from common.functions import sequence_softmax_cross_entropy
 from common.functions import get_mask
-from common.functions import expand_dims
 
 from common.utils import load_data
 from common.utils import w2i, i2w, c2i, i2c, word_length
 from common.utils import with_padding
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
 import argparse
@@ -69,14 +68,14 @@ y_valid = valid_data[:, 1:sentence_length-1].astype(np.int32)
 num_train_batch = len(x_train)//batch_size
 num_valid_batch = len(x_valid)//batch_size
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+def load_train_func(indices):
+    return x_train[indices], y_train[indices]
 
-def load_valid_func(index):
-    return x_valid[index], y_valid[index]
+def load_valid_func(indices):
+    return x_valid[indices], y_valid[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(x_valid), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(x_train), batch_size, shuffle=True)
+valid_data_iter = data_iterator_batch(load_valid_func, len(x_valid), batch_size, shuffle=True)
 
 x = nn.Variable((batch_size, sentence_length))
 mask = get_mask(x)
@@ -95,10 +94,8 @@ h = F.concatenate(h_f, h_b, axis=2)
 with nn.parameter_scope('output'):
     y = time_distributed(PF.affine)(h, vocab_size)
 
-mask = F.sum(get_mask(t), axis=2) # do not predict 'pad'.
-entropy = time_distributed_softmax_cross_entropy(y, expand_dims(t, axis=-1)) * mask
-count = F.sum(mask, axis=1)
-loss = F.mean(F.div2(F.sum(entropy, axis=1), count))
+mask = get_mask(t) # do not predict 'pad'.
+loss = sequence_softmax_cross_entropy(y, t, mask=mask, normalize='sentence')
 
 # Create solver.
 solver = S.Momentum(1e-2, momentum=0.9)
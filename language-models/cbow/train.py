@@ -15,7 +15,6 @@ import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 
@@ -26,9 +25,13 @@ from common.functions import get_mask
 from common.functions import expand_dims
 
 from common.utils import PTBDataset
+from common.utils import load_text_corpus
+from common.utils import subsample
 from common.utils import with_padding
 from utils import to_cbow_dataset
+from utils import calc_sampling_prob
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
 from typing import List
@@ -39,6 +42,15 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--subsample', type=float,
+                    default=0, help='The threshold of subsampling frequent words, resampled every epoch. 0 disables it. '
+                                    'It cannot be used with --train-file because the subsample is kept in memory.')
+parser.add_argument('--train-file', type=str,
+                    default=None, help='A text file of one sentence per line used instead of PTB. It may be larger than memory.')
+parser.add_argument('--valid-file', type=str,
+                    default=None, help='A validation text file used with --train-file.')
+parser.add_argument('--min-freq', type=int,
+                    default=1, help='Words less frequent than this in --train-file become <unk>.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -48,31 +60,33 @@ if args.context == 'cudnn':
 
 window_size = 2
 
-ptb_dataset = PTBDataset()
-
-train_data = ptb_dataset.train_data
-x_train, y_train = to_cbow_dataset(train_data, window_size=window_size)
-
-valid_data = ptb_dataset.valid_data
-x_valid, y_valid = to_cbow_dataset(valid_data, window_size=window_size)
-
-vocab_size = len(ptb_dataset.w2i)
+if args.train_file is None:
+    ptb_dataset = PTBDataset()
+    w2i = ptb_dataset.w2i
+    train_data = ptb_dataset.train_data
+    valid_data = ptb_dataset.valid_data
+else:
+    assert args.valid_file is not None, '--valid-file is required with --train-file.'
+    # the subsample of every epoch is held in memory, which --train-file avoids.
+    assert args.subsample == 0, '--subsample cannot be used with --train-file.'
+    corpora, w2i, _ = load_text_corpus(dict(train=args.train_file, valid=args.valid_file), min_freq=args.min_freq)
+    train_data = corpora['train']
+    valid_data = corpora['valid']
+
+# windows are made per batch instead of materializing all contexts.
+valid_windows = to_cbow_dataset(valid_data, window_size=window_size, lazy=True)
+words, frequencies = calc_sampling_prob(train_data, power=1.0)
+rng = np.random.RandomState(313)
+
+vocab_size = len(w2i)
 embedding_size = 128
 batch_size = 128
 max_epoch = 10
 k = 5
 
-num_train_batch = len(x_train)//batch_size
-num_valid_batch = len(x_valid)//batch_size
-
-def load_train_func(index):
-    return x_train[index], y_train[index]
-
-def load_valid_func(index):
-    return x_valid[index], y_valid[index]
+num_valid_batch = len(valid_windows)//batch_size
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(x_valid), batch_size, shuffle=True, with_file_cache=False)
+valid_data_iter = data_iterator_batch(valid_windows.__getitem__, len(valid_windows), batch_size, shuffle=True)
 
 x = nn.Variable([batch_size, window_size*2])
 with nn.parameter_scope('W_in'):
@@ -92,14 +106,22 @@ solver.set_parameters(nn.get_parameters())
 
 trainer = Trainer(inputs=[x, t], loss=loss, metrics=dict(PPL=np.e**loss), solver=solver)
 
-trainer.run(train_data_iter, valid_data_iter, epochs=max_epoch)
+for epoch in range(max_epoch):
+    # frequent words are dropped at random, differently every epoch.
+    epoch_data = train_data
+    if args.subsample > 0:
+        epoch_data = subsample(train_data, words, frequencies, threshold=args.subsample, rng=rng)
+    train_windows = to_cbow_dataset(epoch_data, window_size=window_size, lazy=True)
+    print(f'epoch {epoch+1}: {len(epoch_data.tokens)}/{len(train_data.tokens)} tokens, {len(train_windows)} windows')
+    train_data_iter = data_iterator_batch(train_windows.__getitem__, len(train_windows), batch_size, shuffle=True)
+    trainer.run(train_data_iter, valid_data_iter, epochs=1)
 
 with open('vectors.txt', 'w') as f:
     f.write('{} {}\n'.format(vocab_size-1, embedding_size))
     with nn.parameter_scope('W_in'):
         x = nn.Variable((1, 1))
         y = PF.embed(x, vocab_size, embedding_size)
-    for word, i in ptb_dataset.w2i.items():
+    for word, i in w2i.items():
         x.d = np.array([[i]])
         y.forward()
         str_vec = ' '.join(map(str, list(y.d.copy()[0][0])))
@@ -15,7 +15,6 @@ import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 
@@ -27,11 +26,13 @@ from common.functions import expand_dims
 
 from common.utils import PTBDataset
 from common.utils import with_padding
+from common.utils import subsample
 
 from utils import to_cbow_dataset
 from utils import calc_sampling_prob
-from utils import negative_sampling
+from utils import NegativeSampler
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
 from typing import List
@@ -42,6 +43,8 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--subsample', type=float,
+                    default=0, help='The threshold of subsampling frequent words, resampled every epoch. 0 disables it.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -56,9 +59,10 @@ ptb_dataset = PTBDataset()
 train_data = ptb_dataset.train_data
 valid_data = ptb_dataset.valid_data
 
-words, prob = calc_sampling_prob(train_data)
-x_train, y_train = to_cbow_dataset(train_data, window_size=window_size)
-x_valid, y_valid = to_cbow_dataset(valid_data, window_size=window_size)
+# windows are made per batch instead of materializing all contexts.
+valid_windows = to_cbow_dataset(valid_data, window_size=window_size, lazy=True)
+words, frequencies = calc_sampling_prob(train_data, power=1.0)
+rng = np.random.RandomState(313)
 
 vocab_size = len(ptb_dataset.w2i)
 embedding_size = 128
@@ -66,17 +70,20 @@ batch_size = 128
 max_epoch = 10
 k = 5
 
-num_train_batch = len(x_train)//batch_size
-num_valid_batch = len(x_valid)//batch_size
+# negatives of a whole batch are drawn at once.
+sampler = NegativeSampler(*calc_sampling_prob(train_data), k=k)
 
-def load_train_func(index):
-    return x_train[index], y_train[index], negative_sampling(y_train[index], words, prob)
+num_valid_batch = len(valid_windows)//batch_size
 
-def load_valid_func(index):
-    return x_valid[index], y_valid[index], negative_sampling(y_valid[index], words, prob)
+def load_train_func(indices):
+    x, y = train_windows[indices]
+    return x, y, sampler(y)
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(x_valid), batch_size, shuffle=True, with_file_cache=False)
+def load_valid_func(indices):
+    x, y = valid_windows[indices]
+    return x, y, sampler(y)
+
+valid_data_iter = data_iterator_batch(load_valid_func, len(valid_windows), batch_size, shuffle=True)
 
 x = nn.Variable([batch_size, window_size*2])
 with nn.parameter_scope('W_in'):
@@ -103,8 +110,16 @@ solver = S.Adam()
 solver.set_parameters(nn.get_parameters())
 
 
-trainer = Trainer(inputs=[x, t, t_neg], loss=loss, solver=solver)
-trainer.run(train_data_iter, valid_data_iter, epochs=max_epoch)
+trainer = Trainer(inputs=[x, t, t_neg], loss=loss, solver=solver, prefetch=4)
+for epoch in range(max_epoch):
+    # frequent words are dropped at random, differently every epoch.
+    epoch_data = train_data
+    if args.subsample > 0:
+        epoch_data = subsample(train_data, words, frequencies, threshold=args.subsample, rng=rng)
+    train_windows = to_cbow_dataset(epoch_data, window_size=window_size, lazy=True)
+    print(f'epoch {epoch+1}: {len(epoch_data.tokens)}/{len(train_data.tokens)} tokens, {len(train_windows)} windows')
+    train_data_iter = data_iterator_batch(load_train_func, len(train_windows), batch_size, shuffle=True)
+    trainer.run(train_data_iter, valid_data_iter, epochs=1)
 
 with open('vectors.txt', 'w') as f:
     f.write('{} {}\n'.format(vocab_size-1, embedding_size))
@@ -8,20 +8,22 @@
 
 import numpy as np
 
-from collections import Counter
+from numpy.lib.stride_tricks import sliding_window_view
 from typing import List
+from typing import Optional
 from typing import Tuple
+from typing import Union
 
-def calc_sampling_prob(sentences: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
-    oneline: List[int] = []
-    for sentence in sentences:
-        oneline.extend(sentence)
-    counter = Counter(oneline)
-    words = np.array(list(counter.keys()), dtype=np.int32)
-    prob = np.array(list(counter.values())) / sum(counter.values())
-    prob = np.power(prob, 0.75)
-    prob = prob / np.sum(prob)
-    return words, prob
+from common.utils import Corpus
+from common.utils import to_flat
+from common.utils import unigram_distribution
+
+def calc_sampling_prob(sentences: Union[Corpus, List[List[int]]], power: float = 0.75) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    The unigram distribution raised to `power`, from which negative samples are drawn.
+    With `power=1.0`, it is the word frequency used by `subsample`.
+    '''
+    return unigram_distribution(sentences, power=power)
 
 def negative_sampling(target: int, words: np.ndarray, prob: np.ndarray, k: int = 5):
     ret = np.random.choice(words, size=k, p=prob)
@@ -29,28 +31,108 @@ def negative_sampling(target: int, words: np.ndarray, prob: np.ndarray, k: int =
         ret = np.random.choice(words, size=k, p=prob)
     return ret
 
-def to_cbow_dataset(sentences: List[List[int]], window_size: int = 1, ns: bool = False):
-    contexts: List[List[int]] = []
-    targets: List[int] = []
+class NegativeSampler(object):
+    '''
+    A sampler of negative words by the alias method, which draws a word in O(1)
+    regardless of the vocabulary size, for a whole batch at once.
+    Args:
+        words (numpy.ndarray): Candidate words.
+        prob (numpy.ndarray): The probability of each word, e.g. from `calc_sampling_prob`.
+        k (int): The number of negative samples per target.
+        rng (numpy.random.RandomState): A random number generator.
+    '''
+    def __init__(self, words: np.ndarray, prob: np.ndarray, k: int = 5, rng: Optional[np.random.RandomState] = None) -> None:
+        self.words = np.asarray(words)
+        self.k = k
+        self.rng = rng if rng is not None else np.random.RandomState(313)
 
+        # Vose's alias method: every bucket holds its own word with `threshold` and the `alias` word otherwise.
+        n = len(prob)
+        scaled = np.asarray(prob, dtype=np.float64) * n / np.sum(prob)
+        self.threshold = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n)
+        small = list(np.flatnonzero(scaled < 1.0))
+        large = list(np.flatnonzero(scaled >= 1.0))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.threshold[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def sample(self, size) -> np.ndarray:
+        buckets = self.rng.randint(len(self.threshold), size=size)
+        use_alias = self.rng.random_sample(size) >= self.threshold[buckets]
+        return self.words[np.where(use_alias, self.alias[buckets], buckets)]
+
+    def __call__(self, targets: np.ndarray) -> np.ndarray:
+        '''
+        Draw `k` negative samples for each target. Samples equal to their target are drawn again.
+        Returns:
+            numpy.ndarray: A shape of (len(targets), k).
+        '''
+        targets = np.asarray(targets).reshape(-1, 1)
+        samples = self.sample((len(targets), self.k))
+        collisions = samples == targets
+        while collisions.any():
+            samples[collisions] = self.sample(np.count_nonzero(collisions))
+            collisions = samples == targets
+        return samples.astype(np.int32, copy=False)
+
+
+class CBOWWindows(object):
+    '''
+    Windows of CBOW which are made lazily per batch.
+    A window is a row of a sliding window view over the flat token array, which costs no memory,
+    and only windows which fit in their sentences are used.
+    `windows[indices]` returns contexts of a shape (len(indices), window_size*2) and targets of (len(indices), 1).
+    '''
+    def __init__(self, sentences: Union[Corpus, List[List[int]]], window_size: int = 1,
+                 sentence_chunk_size: int = 1 << 16) -> None:
+        if isinstance(sentences, Corpus):
+            tokens, offsets = np.asarray(sentences.tokens), np.asarray(sentences.offsets)
+        else:
+            tokens, offsets = to_flat(sentences)
+        self.window_size = window_size
+        self.tokens = tokens
+        # centers are the interior positions [start + window_size, end - window_size) of each sentence,
+        # filled by chunks of sentences so that no temporary array of the corpus length is made.
+        counts = np.maximum(np.diff(offsets) - window_size * 2, 0)
+        dtype = np.int32 if len(tokens) <= np.iinfo(np.int32).max else np.int64
+        self.centers = np.empty(int(np.sum(counts)), dtype=dtype)
+        position = 0
+        for first in range(0, len(counts), sentence_chunk_size):
+            chunk_counts = counts[first:first+sentence_chunk_size]
+            size = int(np.sum(chunk_counts))
+            interior_starts = np.asarray(offsets[first:first+len(chunk_counts)], dtype=np.int64) + window_size
+            steps = np.arange(size) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            self.centers[position:position+size] = np.repeat(interior_starts, chunk_counts) + steps
+            position += size
+        if len(tokens) >= window_size * 2 + 1:
+            self.windows = sliding_window_view(tokens, window_size * 2 + 1)
+        else:
+            self.windows = np.zeros((0, window_size * 2 + 1), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+    def __getitem__(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        windows = self.windows[self.centers[indices] - self.window_size]
+        contexts = np.delete(windows, self.window_size, axis=-1)
+        targets = windows[..., self.window_size:self.window_size+1]
+        return contexts.astype(np.int32, copy=False), targets.astype(np.int32, copy=False)
+
+
+def to_cbow_dataset(sentences: Union[Corpus, List[List[int]]], window_size: int = 1, ns: bool = False, lazy: bool = False):
+    '''
+    Make contexts and targets of CBOW (and negative samples if `ns`).
+    With `lazy`, a `CBOWWindows` is returned instead, which makes them per batch.
+    '''
+    windows = CBOWWindows(sentences, window_size=window_size)
+    if lazy:
+        return windows
+
+    ret = list(windows[np.arange(len(windows))])
     if ns:
-        negative_samples: List[np.ndarray] = []
-        words, prob = calc_sampling_prob(sentences)
-
-    for sentence in sentences:
-        for _index in range(window_size, len(sentence)-window_size):
-            targets.append(sentence[_index])
-            if ns:
-                negative_samples.append(negative_sampling(sentence[_index], words, prob))
-            ctx: List[int] = []
-            for t in range(-window_size, window_size+1):
-                if t == 0:
-                    continue
-                ctx.append(sentence[_index + t])
-            contexts.append(ctx)
-    
-    ret = [np.array(contexts, dtype=np.int32), np.array(targets, dtype=np.int32)[:, None]]
-    if ns:
-        ret.append(np.array(negative_samples, dtype=np.int32))
+        ret.append(NegativeSampler(*calc_sampling_prob(sentences))(ret[1]))
     return tuple(ret)
-
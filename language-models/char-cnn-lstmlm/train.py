@@ -15,20 +15,20 @@ import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 
 from common.parametric_functions import lstm
 from common.parametric_functions import highway
 from common.functions import time_distributed
-from common.functions import time_distributed_softmax_cross_entropy
+from common.functions import sequence_softmax_cross_entropy
 from common.functions import expand_dims
 from common.functions import get_mask
 
 from common.utils import PTBDataset
 from common.utils import with_padding
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
 from utils import wordseq2charseq
@@ -60,24 +60,24 @@ char_vocab_size = len(ptb_dataset.c2i)
 
 x_train = train_data[:, :sentence_length].astype(np.int32)
 y_train = train_data[:, 1:sentence_length+1].astype(np.int32)
-x_train = wordseq2charseq(x_train, ptb_dataset.i2w, ptb_dataset.c2i, ptb_dataset.i2c)
+x_train = wordseq2charseq(x_train, ptb_dataset.i2w, ptb_dataset.c2i, ptb_dataset.i2c, char_table=ptb_dataset.char_table)
 
 x_valid = valid_data[:, :sentence_length].astype(np.int32)
 y_valid = valid_data[:, 1:sentence_length+1].astype(np.int32)
 
-x_valid = wordseq2charseq(x_valid, ptb_dataset.i2w, ptb_dataset.c2i, ptb_dataset.i2c)
+x_valid = wordseq2charseq(x_valid, ptb_dataset.i2w, ptb_dataset.c2i, ptb_dataset.i2c, char_table=ptb_dataset.char_table)
 
 num_train_batch = len(x_train)//batch_size
 num_valid_batch = len(x_valid)//batch_size
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+def load_train_func(indices):
+    return x_train[indices], y_train[indices]
 
-def load_valid_func(index):
-    return x_valid[index], y_valid[index]
+def load_valid_func(indices):
+    return x_valid[indices], y_valid[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(x_valid), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(x_train), batch_size, shuffle=True)
+valid_data_iter = data_iterator_batch(load_valid_func, len(x_valid), batch_size, shuffle=True)
 
 char_embedding_dim = 16
 lstm_size = 650
@@ -123,9 +123,7 @@ def build_model(train=True, get_embeddings=False):
         y = time_distributed(PF.affine)(h, word_vocab_size)
 
     mask = F.sign(t) # do not predict 'pad'.
-    entropy = time_distributed_softmax_cross_entropy(y, expand_dims(t, axis=-1)) * mask
-    count = F.sum(mask, axis=1)
-    loss = F.mean(F.div2(F.sum(entropy, axis=1), count))
+    loss = sequence_softmax_cross_entropy(y, t, mask=mask, normalize='sentence')
     return x, t, loss
 
 x, t, loss = build_model()
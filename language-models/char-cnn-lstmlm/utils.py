@@ -10,17 +10,20 @@ import numpy as np
 
 from typing import List
 from typing import Dict
+from typing import Optional
 
-def wordseq2charseq(data: np.ndarray, i2w: Dict[int, str], c2i: Dict[str, int], i2c: Dict[int, str], word_length: int = 20) -> np.ndarray:
-    data = np.repeat(np.expand_dims(data, axis=2), word_length, axis=2)
-    data[:, :, 1:] = 0
-    for i in range(data.shape[0]):
-        for j in range(data.shape[1]):
-            word = data[i][j][0]
-            if word != 0:
-                for k, char in enumerate(i2w[word]):
-                    data[i][j][k] = c2i[char]
-            else:
-                data[i, j, :] = 0
-    return data
+from common.utils import build_char_table
 
+def wordseq2charseq(data: np.ndarray, i2w: Dict[int, str], c2i: Dict[str, int], i2c: Dict[int, str], word_length: int = 20,
+                    char_table: Optional[np.ndarray] = None) -> np.ndarray:
+    '''
+    Encode word id sequences into char id sequences.
+    Args:
+        data (numpy.ndarray): A shape of (batch_size, sentence_length).
+        char_table (numpy.ndarray): A table made by `build_char_table`. It is built from `i2w` and `c2i` if not given.
+    Returns:
+        numpy.ndarray: A shape of (batch_size, sentence_length, word_length).
+    '''
+    if char_table is None:
+        char_table = build_char_table(i2w, c2i, word_length=word_length)
+    return char_table[data]
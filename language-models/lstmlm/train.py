@@ -12,22 +12,21 @@ sys.path.append('../../')
 import numpy as np
 
 import nnabla as nn
-import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 
 from common.parametric_functions import lstm
 from common.functions import time_distributed
-from common.functions import time_distributed_softmax_cross_entropy
+from common.functions import sequence_softmax_cross_entropy
 from common.functions import get_mask
-from common.functions import expand_dims
 
 from common.utils import PTBDataset
+from common.utils import load_text_corpus
 from common.utils import with_padding
 
+from common.data_iterator import BucketIterator
 from common.trainer import Trainer
 
 import argparse
@@ -36,6 +35,14 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--train-file', type=str,
+                    default=None, help='A text file of one sentence per line used instead of PTB. It may be larger than memory.')
+parser.add_argument('--valid-file', type=str,
+                    default=None, help='A validation text file used with --train-file.')
+parser.add_argument('--min-freq', type=int,
+                    default=1, help='Words less frequent than this in --train-file become <unk>.')
+parser.add_argument('--backend', type=str,
+                    default='graph', choices=['graph', 'hoisted', 'fused'], help='graph unrolls recurrent layers into the graph, hoisted computes their input projections before the loop, and fused runs the built-in RNN kernels on the same parameters.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -43,58 +50,64 @@ if args.context == 'cudnn':
     ctx = get_extension_context('cudnn', device_id=args.device)
     nn.set_default_context(ctx)
 
-ptb_dataset = PTBDataset()
-
-train_data = with_padding(ptb_dataset.train_data, padding_type='post')
-valid_data = with_padding(ptb_dataset.valid_data, padding_type='post')
-
-vocab_size = len(ptb_dataset.w2i)
+if args.train_file is None:
+    ptb_dataset = PTBDataset()
+    w2i = ptb_dataset.w2i
+    train_data = ptb_dataset.train_data
+    valid_data = ptb_dataset.valid_data
+else:
+    assert args.valid_file is not None, '--valid-file is required with --train-file.'
+    corpora, w2i, _ = load_text_corpus(dict(train=args.train_file, valid=args.valid_file), min_freq=args.min_freq)
+    train_data = corpora['train']
+    valid_data = corpora['valid']
+
+vocab_size = len(w2i)
 sentence_length = 60
 embedding_size = 128
 hidden_size = 128
 batch_size = 32
+max_tokens = batch_size * sentence_length
 max_epoch = 100
-
-x_train = train_data[:, :sentence_length].astype(np.int32)
-y_train = train_data[:, 1:sentence_length+1].astype(np.int32)
-
-x_valid = valid_data[:, :sentence_length].astype(np.int32)
-y_valid = valid_data[:, 1:sentence_length+1].astype(np.int32)
-
-num_train_batch = len(x_train)//batch_size
-num_valid_batch = len(x_valid)//batch_size
-
-def load_train_func(index):
-    return x_train[index], y_train[index]
-
-def load_valid_func(index):
-    return x_valid[index], y_valid[index]
-
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(x_valid), batch_size, shuffle=True, with_file_cache=False)
-
-x = nn.Variable((batch_size, sentence_length))
-mask = get_mask(x)
-t = nn.Variable((batch_size, sentence_length))
-
-with nn.parameter_scope('embedding'):
-    h = PF.embed(x, vocab_size, embedding_size) * mask
-with nn.parameter_scope('lstm1'):
-    h = lstm(h, hidden_size, mask=mask, return_sequences=True)
-with nn.parameter_scope('lstm2'):
-    h = lstm(h, hidden_size, mask=mask, return_sequences=True)
-with nn.parameter_scope('output'):
-    y = time_distributed(PF.affine)(h, vocab_size)
-
-mask = F.sum(mask, axis=2) # do not predict 'pad'.
-entropy = time_distributed_softmax_cross_entropy(y, expand_dims(t, axis=-1)) * mask
-# count = F.sum(mask, axis=1)
-# loss = F.mean(F.div2(F.sum(entropy, axis=1), count))
-loss = F.sum(entropy) / F.sum(mask)
+bucket_width = 10
+
+def load_train_func(indices, length):
+    data = with_padding(train_data[indices], padding_type='post', max_sequence_length=length+1)
+    return data[:, :length], data[:, 1:length+1]
+
+def load_valid_func(indices, length):
+    data = with_padding(valid_data[indices], padding_type='post', max_sequence_length=length+1)
+    return data[:, :length], data[:, 1:length+1]
+
+# batches are grouped by length and hold as many sentences as fit in max_tokens.
+train_data_iter = BucketIterator(train_data.lengths, load_train_func, bucket_width=bucket_width, max_length=sentence_length,
+                                 max_tokens=max_tokens, shuffle=True)
+valid_data_iter = BucketIterator(valid_data.lengths, load_valid_func, bucket_width=bucket_width, max_length=sentence_length,
+                                 max_tokens=max_tokens, shuffle=True)
+
+num_train_batch = train_data_iter.num_batch
+num_valid_batch = valid_data_iter.num_batch
+
+def build_model(x, t):
+    mask = get_mask(x)
+    with nn.parameter_scope('embedding'):
+        h = PF.embed(x, vocab_size, embedding_size) * mask
+    with nn.parameter_scope('lstm1'):
+        h = lstm(h, hidden_size, mask=mask, return_sequences=True, backend=args.backend)
+    with nn.parameter_scope('lstm2'):
+        h = lstm(h, hidden_size, mask=mask, return_sequences=True, backend=args.backend)
+    with nn.parameter_scope('output'):
+        y = time_distributed(PF.affine)(h, vocab_size)
+
+    loss = sequence_softmax_cross_entropy(y, t, mask=mask, normalize='token') # do not predict 'pad'.
+    return loss, {'PPL': np.e**loss}
+
+# the graph of a training batch creates the parameters. graphs of other shapes are built by the trainer.
+x, t = [nn.Variable(d.shape) for d in train_data_iter.next()]
+loss, metrics = build_model(x, t)
 
 # Create solver.
 solver = S.Momentum(1e-2, momentum=0.9)
 solver.set_parameters(nn.get_parameters())
 
-trainer = Trainer(inputs=[x, t], loss=loss, metrics={'PPL': np.e**loss}, solver=solver)
+trainer = Trainer(inputs=[x, t], loss=loss, metrics=metrics, solver=solver, graph_builder=build_model)
 trainer.run(train_data_iter, valid_data_iter, epochs=max_epoch)
@@ -12,23 +12,21 @@ sys.path.append('../../')
 import numpy as np
 
 import nnabla as nn
-import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 from pathlib import Path
 
 from common.parametric_functions import simple_rnn
 from common.functions import time_distributed
-from common.functions import time_distributed_softmax_cross_entropy
+from common.functions import sequence_softmax_cross_entropy
 from common.functions import get_mask
-from common.functions import expand_dims
 
 from common.utils import PTBDataset
 from common.utils import with_padding
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
 import argparse
@@ -37,6 +35,8 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--backend', type=str,
+                    default='graph', choices=['graph', 'hoisted', 'fused'], help='graph unrolls recurrent layers into the graph, hoisted computes their input projections before the loop, and fused runs the built-in RNN kernels on the same parameters.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -65,14 +65,14 @@ y_valid = valid_data[:, 1:sentence_length+1].astype(np.int32)
 num_train_batch = len(x_train)//batch_size
 num_valid_batch = len(x_valid)//batch_size
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+def load_train_func(indices):
+    return x_train[indices], y_train[indices]
 
-def load_valid_func(index):
-    return x_valid[index], y_valid[index]
+def load_valid_func(indices):
+    return x_valid[indices], y_valid[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(x_valid), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(x_train), batch_size, shuffle=True)
+valid_data_iter = data_iterator_batch(load_valid_func, len(x_valid), batch_size, shuffle=True)
 
 x = nn.Variable((batch_size, sentence_length))
 mask = get_mask(x)
@@ -80,14 +80,11 @@ t = nn.Variable((batch_size, sentence_length))
 with nn.parameter_scope('embedding'):
     h = time_distributed(PF.embed)(x, vocab_size, embedding_size) * mask
 with nn.parameter_scope('rnn'):
-    h = simple_rnn(h, hidden_size, mask=mask, return_sequences=True)
+    h = simple_rnn(h, hidden_size, mask=mask, return_sequences=True, backend=args.backend)
 with nn.parameter_scope('output'):
     y = time_distributed(PF.affine)(h, vocab_size)
 
-mask = F.sum(mask, axis=2)
-entropy = time_distributed_softmax_cross_entropy(y, expand_dims(t, axis=-1)) * mask
-count = F.sum(mask, axis=1)
-loss = F.mean(F.div2(F.sum(entropy, axis=1), count))
+loss = sequence_softmax_cross_entropy(y, t, mask=mask, normalize='sentence')
 
 # Create solver.
 solver = S.Momentum(1e-2, momentum=0.9)
@@ -15,7 +15,6 @@ import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
-from nnabla.utils.data_iterator import data_iterator_simple
 
 from tqdm import tqdm
 
@@ -24,11 +23,12 @@ from common.parametric_functions import lstm_cell
 
 from common.functions import get_mask
 from common.functions import time_distributed
-from common.functions import time_distributed_softmax_cross_entropy
+from common.functions import sequence_softmax_cross_entropy
 
 from common.utils import load_enja_parallel_data
 from common.utils import with_padding
 
+from common.data_iterator import BucketIterator
 from common.trainer import Trainer
 
 from parametric_functions import global_attention
@@ -47,41 +47,44 @@ if args.context == 'cudnn':
     nn.set_default_context(ctx)
 
 train_source, dev_source, test_source, w2i_source, i2w_source = load_enja_parallel_data('en')
-train_source = with_padding(train_source, padding_type='post')[:,::-1].astype(np.int32)
-dev_source = with_padding(dev_source, padding_type='post')[:,::-1].astype(np.int32)
 test_source = with_padding(test_source, padding_type='post')[:,::-1].astype(np.int32)
 
 train_target, dev_target, test_target, w2i_target, i2w_target = load_enja_parallel_data('ja')
-train_target = with_padding(train_target, padding_type='post').astype(np.int32)
-dev_target = with_padding(dev_target, padding_type='post').astype(np.int32)
 test_target = with_padding(test_target, padding_type='post').astype(np.int32)
 
 vocab_size_source = len(w2i_source)
 vocab_size_target = len(w2i_target)
-sentence_length_source = train_source.shape[1]
-sentence_length_target = train_target.shape[1]
+sentence_length_source = int(train_source.lengths.max())
+sentence_length_target = int(train_target.lengths.max())
 embedding_size = 1024
 hidden = 1024
 batch_size = 64
+max_tokens = batch_size * (sentence_length_source + sentence_length_target)
+bucket_width = 4
 max_epoch = 500
 
-num_train_batch = len(train_source)//batch_size
-num_dev_batch = len(dev_source)//batch_size
+def load_train_func(indices, length_source, length_target):
+    return with_padding(train_source[indices], padding_type='post', max_sequence_length=length_source)[:,::-1], \
+           with_padding(train_target[indices], padding_type='post', max_sequence_length=length_target)
 
-def load_train_func(index):
-    return train_source[index], train_target[index]
+def load_dev_func(indices, length_source, length_target):
+    return with_padding(dev_source[indices], padding_type='post', max_sequence_length=length_source)[:,::-1], \
+           with_padding(dev_target[indices], padding_type='post', max_sequence_length=length_target)
 
-def load_dev_func(index):
-    return dev_source[index], dev_target[index]
+# a batch holds as many sentence pairs as fit in max_tokens source and target tokens.
+train_data_iter = BucketIterator(np.stack([train_source.lengths, train_target.lengths], axis=1), load_train_func,
+                                 bucket_width=bucket_width, max_tokens=max_tokens, shuffle=True)
+dev_data_iter = BucketIterator(np.stack([dev_source.lengths, dev_target.lengths], axis=1), load_dev_func,
+                               bucket_width=bucket_width, max_tokens=max_tokens, shuffle=True)
 
-train_data_iter = data_iterator_simple(load_train_func, len(train_source), batch_size, shuffle=True, with_file_cache=False)
-dev_data_iter = data_iterator_simple(load_dev_func, len(dev_source), batch_size, shuffle=True, with_file_cache=False)
+num_train_batch = train_data_iter.num_batch
+num_dev_batch = dev_data_iter.num_batch
 
 
-def build_model():
-    x = nn.Variable((batch_size, sentence_length_source))
+def build_model(x, y):
+    batch_size, sentence_length_source = x.shape
+    batch_size, sentence_length_target = y.shape
     mask = get_mask(x)
-    y = nn.Variable((batch_size, sentence_length_target))
     
     enc_input = time_distributed(PF.embed)(x, vocab_size_source, embedding_size, name='enc_embeddings') * mask
     # -> (batch_size, sentence_length_source, embedding_size)
@@ -113,14 +116,9 @@ def build_model():
 
     t = F.reshape(y, (batch_size, sentence_length_target, 1))
 
-    entropy = time_distributed_softmax_cross_entropy(output, t)
-
-    mask = F.sum(F.sign(t), axis=2) # do not predict 'pad'.
-    count = F.sum(mask, axis=1)
-
-    entropy *= mask
-    loss = F.mean(F.sum(entropy, axis=1)/count)
-    return x, y, loss
+    mask = F.sign(t) # do not predict 'pad'.
+    loss = sequence_softmax_cross_entropy(output, t, mask=mask, normalize='sentence')
+    return loss, dict(PPL=np.e**loss)
 
 
 def predict(x):
@@ -176,12 +174,14 @@ def translate(sentence):
     sentence.reverse()
     return ''.join([i2w_target[i] for i in predict(np.array([sentence]))])
 
-x, y, loss = build_model()
+# the graph of a training batch creates the parameters. graphs of other shapes are built by the trainer.
+x, y = [nn.Variable(d.shape) for d in train_data_iter.next()]
+loss, metrics = build_model(x, y)
 
 # Create solver.
 solver = S.Momentum(1e-2, momentum=0.9)
 solver.set_parameters(nn.get_parameters())
 
-trainer = Trainer(inputs=[x, y], loss=loss, metrics=dict(PPL=np.e**loss), solver=solver)
+trainer = Trainer(inputs=[x, y], loss=loss, metrics=metrics, solver=solver, graph_builder=build_model)
 trainer.run(train_data_iter, dev_data_iter, epochs=5, verbose=1)
 
@@ -7,7 +7,7 @@
 #
 
 """
-This is implementation of fasttext with bigram features.
+This is implementation of fasttext with hashed n-gram features.
 see [Bag of Tricks for Efficient Text Classification](https://arxiv.org/abs/1607.01759)
 """
 
@@ -21,24 +21,28 @@ import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
 
-from nnabla.utils.data_iterator import data_iterator_simple
-
 from pathlib import Path
-from tqdm import tqdm
 
 from common.functions import time_distributed
 from common.functions import get_mask
 from common.utils import load_imdb
 from common.utils import with_padding
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
+from utils import add_hashed_ngrams
+
 import argparse
 parser = argparse.ArgumentParser(description='Encoder-decoder model training.')
 parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--ngram', '-n', type=int,
+                    default=2, help='The maximum order of n-gram features.')
+parser.add_argument('--num-buckets', type=int,
+                    default=1000000, help='The number of hash buckets of n-gram features.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -54,30 +58,10 @@ vocab_size: int = 20000
 
 x_train, x_test, y_train, y_test = load_imdb(vocab_size)
 
-def get_bigram(sentence):
-    return list(zip(sentence[:len(sentence)-1], sentence[1:]))
-
-bigram_dict: dict = dict()
-bigram_index = vocab_size
-
-print("making bigram dictionary...")
-for sentence in tqdm(x_train):
-    for bigram in set(get_bigram(sentence)):
-        if bigram not in bigram_dict:
-            bigram_dict[bigram] = bigram_index
-            bigram_index += 1
-
-vocab_size = bigram_index + 1
-    
-print("adding bigram to dataset..")
-for i, sentence in enumerate(tqdm(x_train)):
-    for bigram in get_bigram(sentence):
-        if bigram in bigram_dict:
-            x_train[i].append(bigram_dict[bigram])
-for i, sentence in enumerate(tqdm(x_test)):
-    for bigram in get_bigram(sentence):
-        if bigram in bigram_dict:
-            x_test[i].append(bigram_dict[bigram])
+print("adding hashed n-grams to dataset..")
+x_train = add_hashed_ngrams(x_train, vocab_size, args.num_buckets, n=args.ngram)
+x_test = add_hashed_ngrams(x_test, vocab_size, args.num_buckets, n=args.ngram)
+vocab_size = vocab_size + args.num_buckets
 
 x_train = with_padding(x_train, padding_type='post', max_sequence_length=max_len)
 x_test = with_padding(x_test, padding_type='post', max_sequence_length=max_len)
@@ -87,14 +71,14 @@ y_test = y_test[:, None]
 num_train_batch = len(x_train)//batch_size
 num_dev_batch = len(x_test)//batch_size
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+def load_train_func(indices):
+    return x_train[indices], y_train[indices]
 
-def load_dev_func(index):
-    return x_test[index], y_test[index]
+def load_dev_func(indices):
+    return x_test[indices], y_test[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-dev_data_iter = data_iterator_simple(load_dev_func, len(x_test), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(x_train), batch_size, shuffle=True)
+dev_data_iter = data_iterator_batch(load_dev_func, len(x_test), batch_size, shuffle=True)
 
 def global_average_pooling_1d(x, mask):
     count = F.sum(mask, axis=1)
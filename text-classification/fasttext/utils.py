@@ -0,0 +1,66 @@
+#
+# Copyright (c) 2017-2019 Minato Sato
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import numpy as np
+
+from typing import Tuple
+
+from common.utils import Corpus
+
+
+def hash_ngrams(tokens: np.ndarray, offsets: np.ndarray, n: int, num_buckets: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Hash n-grams which do not cross sentence boundaries into `num_buckets` buckets (the hashing trick).
+    Args:
+        tokens (numpy.ndarray): Flat token ids.
+        offsets (numpy.ndarray): Sentence boundaries of `tokens`.
+        n (int): The order of n-grams.
+        num_buckets (int): The number of hash buckets.
+    Returns:
+        numpy.ndarray: Bucket ids of n-grams, in the order of their positions.
+        numpy.ndarray: Sentence ids of n-grams.
+    '''
+    lengths = np.diff(offsets)
+    sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.arange(max(len(tokens) - n + 1, 0))
+    starts = starts[starts + n <= offsets[1:][sentence_ids[starts]]]
+
+    # the same hash function as fastText, computed over all n-grams at once.
+    hashes = np.zeros(len(starts), dtype=np.uint64)
+    for k in range(n):
+        hashes = hashes * np.uint64(116049371) + tokens[starts + k].astype(np.uint64)
+    return (hashes % np.uint64(num_buckets)).astype(np.int64), sentence_ids[starts]
+
+
+def add_hashed_ngrams(corpus: Corpus, vocab_size: int, num_buckets: int, n: int = 2) -> Corpus:
+    '''
+    Append hashed 2-grams, ..., n-grams to every sentence after its tokens,
+    as ids in [vocab_size, vocab_size + num_buckets).
+    Args:
+        corpus (Corpus): Sentences of token ids less than `vocab_size`.
+        vocab_size (int): The number of words.
+        num_buckets (int): The number of hash buckets, which bounds the size of the embedding matrix.
+        n (int): The maximum order of n-grams.
+    Returns:
+        Corpus: Sentences with n-gram features.
+    '''
+    tokens, offsets = np.asarray(corpus.tokens), np.asarray(corpus.offsets)
+    lengths = np.diff(offsets)
+    features = [tokens.astype(np.int64)]
+    sentence_ids = [np.repeat(np.arange(len(lengths)), lengths)]
+    for order in range(2, n + 1):
+        hashes, ids = hash_ngrams(tokens, offsets, order, num_buckets)
+        features.append(hashes + vocab_size)
+        sentence_ids.append(ids)
+
+    # a stable sort by sentence keeps tokens, 2-grams, ..., n-grams in order within each sentence.
+    sentence_ids = np.concatenate(sentence_ids)
+    order = np.argsort(sentence_ids, kind='stable')
+    new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sentence_ids, minlength=len(lengths)), out=new_offsets[1:])
+    return Corpus(np.concatenate(features)[order].astype(np.int32), new_offsets)
@@ -16,8 +16,6 @@ import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
 
-from nnabla.utils.data_iterator import data_iterator_simple
-
 from pathlib import Path
 from tqdm import tqdm
 
@@ -26,6 +24,7 @@ from common.functions import time_distributed
 from common.functions import get_mask
 from common.utils import load_imdb
 from common.utils import with_padding
+from common.data_iterator import BucketIterator
 from common.trainer import Trainer
 
 import argparse
@@ -34,6 +33,8 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--backend', type=str,
+                    default='graph', choices=['graph', 'hoisted', 'fused'], help='graph unrolls recurrent layers into the graph, hoisted computes their input projections before the loop, and fused runs the built-in RNN kernels on the same parameters.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -47,43 +48,47 @@ embedding_size: int = 128
 hidden_size: int = 128
 max_epoch: int = 5
 vocab_size: int = 20000
+bucket_width: int = 50
 
 x_train, x_test, y_train, y_test = load_imdb(vocab_size)
 
-x_train = with_padding(x_train, padding_type='post', max_sequence_length=max_len)
-x_test = with_padding(x_test, padding_type='post', max_sequence_length=max_len)
 y_train = y_train[:, None]
 y_test = y_test[:, None]
 
-num_train_batch = len(x_train)//batch_size
-num_dev_batch = len(x_test)//batch_size
+def load_train_func(indices, length):
+    return with_padding(x_train[indices], padding_type='post', max_sequence_length=length), y_train[indices]
+
+def load_dev_func(indices, length):
+    return with_padding(x_test[indices], padding_type='post', max_sequence_length=length), y_test[indices]
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+# batches are grouped by length so that short reviews are not padded up to max_len.
+train_data_iter = BucketIterator(x_train.lengths, load_train_func, batch_size, bucket_width=bucket_width, max_length=max_len, shuffle=True)
+dev_data_iter = BucketIterator(x_test.lengths, load_dev_func, batch_size, bucket_width=bucket_width, max_length=max_len, shuffle=True)
 
-def load_dev_func(index):
-    return x_test[index], y_test[index]
+num_train_batch = train_data_iter.num_batch
+num_dev_batch = dev_data_iter.num_batch
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-dev_data_iter = data_iterator_simple(load_dev_func, len(x_test), batch_size, shuffle=True, with_file_cache=False)
 
+def build_model(x, t):
+    mask = get_mask(x)
+    with nn.parameter_scope('embedding'):
+        h = time_distributed(PF.embed)(x, vocab_size, embedding_size) * mask
+    with nn.parameter_scope('lstm_layer'):
+        h = lstm(h, hidden_size, mask=mask, return_sequences=False, backend=args.backend)
+    with nn.parameter_scope('output'):
+        y = F.sigmoid(PF.affine(h, 1))
+
+    accuracy = F.mean(F.equal(F.round(y), t))
+    loss = F.mean(F.binary_cross_entropy(y, t))
+    return loss, {'cross entropy': loss, 'accuracy': accuracy}
 
 x = nn.Variable((batch_size, max_len))
 t = nn.Variable((batch_size, 1))
-mask = get_mask(x)
-with nn.parameter_scope('embedding'):
-    h = time_distributed(PF.embed)(x, vocab_size, embedding_size) * mask
-with nn.parameter_scope('lstm_layer'):
-    h = lstm(h, hidden_size, mask=mask, return_sequences=False)
-with nn.parameter_scope('output'):
-    y = F.sigmoid(PF.affine(h, 1))
-
-accuracy = F.mean(F.equal(F.round(y), t))
-loss = F.mean(F.binary_cross_entropy(y, t))
+loss, metrics = build_model(x, t)
 
 # Create solver.
 solver = S.Adam()
 solver.set_parameters(nn.get_parameters())
 
-trainer = Trainer(inputs=[x, t], loss=loss, metrics={'cross entropy': loss, 'accuracy': accuracy}, solver=solver)
+trainer = Trainer(inputs=[x, t], loss=loss, metrics=metrics, solver=solver, graph_builder=build_model, prefetch=4)
 trainer.run(train_data_iter, dev_data_iter, epochs=5, verbose=1)
@@ -16,8 +16,6 @@ import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.solvers as S
 
-from nnabla.utils.data_iterator import data_iterator_simple
-
 from pathlib import Path
 from tqdm import tqdm
 
@@ -28,6 +26,7 @@ from common.functions import batch_eye
 from common.functions import get_mask
 from common.utils import load_imdb
 from common.utils import with_padding
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
 import argparse
@@ -66,14 +65,14 @@ y_test = y_test[:, None]
 num_train_batch = len(x_train)//batch_size
 num_dev_batch = len(x_test)//batch_size
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+def load_train_func(indices):
+    return x_train[indices], y_train[indices]
 
-def load_dev_func(index):
-    return x_test[index], y_test[index]
+def load_dev_func(indices):
+    return x_test[indices], y_test[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-dev_data_iter = data_iterator_simple(load_dev_func, len(x_test), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(x_train), batch_size, shuffle=True)
+dev_data_iter = data_iterator_batch(load_dev_func, len(x_test), batch_size, shuffle=True)
 
 
 def build_self_attention_model(train=True):
@@ -86,7 +85,7 @@ def build_self_attention_model(train=True):
     with nn.parameter_scope('forward'):
         h_f = lstm(h,            hidden_size, mask=mask, return_sequences=True, return_state=False)
     with nn.parameter_scope('backward'):
-        h_b = lstm(h[:, ::-1, ], hidden_size, mask=mask, return_sequences=True, return_state=False)[:, ::-1, ]
+        h_b = lstm(h[:, ::-1, ], hidden_size, mask=mask[:, ::-1, ], return_sequences=True, return_state=False)[:, ::-1, ]
     h = F.concatenate(h_f, h_b, axis=2)
     if train:
         h = F.dropout(h, p=dropout_ratio)
@@ -44,24 +44,14 @@ def layer_normalization(x: nn.Variable, eps:float=1e-6) -> nn.Variable:
 
 
 def time_distributed(func):
+    '''
+    Apply `func` to every timestep of x of a shape (batch_size, length, ...) with a single call,
+    by folding the time axis into the batch axis.
+    '''
     def time_distributed_func(x, *args, **kwargs):
-        ret = []
-        batch_size = x.shape[0]
-        length = x.shape[1]
-        dim = x.shape[2] if x.ndim > 2 else 1
-        if length > 1:
-            xs = F.split(x, axis=1)
-        else:
-            xs = [F.reshape(x, (batch_size, dim))]
-        for x_ in xs:
-            value = func(x_, *args, **kwargs)
-            _, output_dim = value.shape
-            ret.append(F.reshape(value, (batch_size, 1, output_dim)))
-        
-        if length > 1:
-            return F.concatenate(*ret, axis=1)
-        else:
-            return ret[0]
+        batch_size, length = x.shape[:2]
+        value = func(F.reshape(x, (batch_size * length, ) + tuple(x.shape[2:])), *args, **kwargs)
+        return F.reshape(value, (batch_size, length) + tuple(value.shape[1:]))
     return time_distributed_func
 
 
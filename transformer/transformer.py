@@ -6,14 +6,15 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import sys
+sys.path.append('../')
+
 import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 import nnabla.initializer as I
 import nnabla.solvers as S
 
-from nnabla.utils.data_iterator import data_iterator_simple
-
 import numpy as np
 
 from typing import Optional
@@ -33,6 +34,8 @@ from functions import get_attention_logit_mask
 
 from tqdm import tqdm
 
+from common.data_iterator import data_iterator_batch
+
 import argparse
 parser = argparse.ArgumentParser(description='Encoder-decoder model training.')
 parser.add_argument('--context', '-c', type=str,
@@ -71,14 +74,14 @@ y_test = y_test[:, None]
 num_train_batch = len(x_train)//batch_size
 num_dev_batch = len(x_test)//batch_size
 
-def load_train_func(index):
-    return x_train[index], y_train[index]
+def load_train_func(indices):
+    return x_train[indices], y_train[indices]
 
-def load_dev_func(index):
-    return x_test[index], y_test[index]
+def load_dev_func(indices):
+    return x_test[indices], y_test[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(x_train), batch_size, shuffle=True, with_file_cache=False)
-dev_data_iter = data_iterator_simple(load_dev_func, len(x_test), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(x_train), batch_size, shuffle=True)
+dev_data_iter = data_iterator_batch(load_dev_func, len(x_test), batch_size, shuffle=True)
 
 vocab_size += 1
 
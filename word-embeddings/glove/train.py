@@ -20,8 +20,6 @@ from nnabla.experimental.trainers import Trainer
 from nnabla.experimental.trainers import Updater
 from nnabla.experimental.trainers import Evaluator
 
-from nnabla.utils.data_iterator import data_iterator_simple
-
 from common.parametric_functions import lstm
 from common.functions import time_distributed
 from common.functions import time_distributed_softmax_cross_entropy
@@ -29,9 +27,13 @@ from common.functions import get_mask
 from common.functions import expand_dims
 
 from common.utils import PTBDataset
+from common.utils import dataset_dir
+from common.utils import subsample
+from common.utils import unigram_distribution
 from common.utils import with_padding
+from common.data_iterator import data_iterator_batch
 
-from utils import to_glove_dataset
+from utils import build_glove_dataset
 
 import argparse
 parser = argparse.ArgumentParser(description='GloVe model training.')
@@ -39,6 +41,14 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--distance-weighting', action='store_true',
+                    help='Count a co-occurrence d words apart as 1/d.')
+parser.add_argument('--symmetric', action='store_true',
+                    help='Count following context words as well as preceding ones.')
+parser.add_argument('--num-workers', type=int,
+                    default=1, help='The number of processes counting co-occurrences.')
+parser.add_argument('--subsample', type=float,
+                    default=0, help='The threshold of subsampling frequent words before counting. 0 disables it.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -54,20 +64,35 @@ batch_size = 128
 max_epoch = 100
 window_size = 10
 
-central_train, context_train, target_train = to_glove_dataset(ptb_dataset.train_data, vocab_size=vocab_size, window_size=window_size)
-central_valid, context_valid, target_valid = to_glove_dataset(ptb_dataset.valid_data, vocab_size=vocab_size, window_size=window_size)
+cooccurrence_options = dict(vocab_size=vocab_size, window_size=window_size, distance_weighting=args.distance_weighting,
+                            symmetric=args.symmetric, num_workers=args.num_workers)
+
+def glove_dataset_dir(type_name):
+    return dataset_dir(f'glove-ptb-{type_name}-window_size_{window_size}-'
+                       f'distance_weighting_{args.distance_weighting}-symmetric_{args.symmetric}-subsample_{args.subsample}')
+
+# frequent words are dropped once before counting, with a fixed seed so that the dataset can be reused.
+train_data = ptb_dataset.train_data
+if args.subsample > 0:
+    words, frequencies = unigram_distribution(train_data)
+    train_data = subsample(train_data, words, frequencies, threshold=args.subsample, rng=np.random.RandomState(313))
+print(f'{len(train_data.tokens)}/{len(ptb_dataset.train_data.tokens)} tokens are used for counting co-occurrences')
+
+# co-occurrences are counted out of core and read as memory maps.
+central_train, context_train, target_train = build_glove_dataset(glove_dataset_dir('train'), train_data, **cooccurrence_options)
+central_valid, context_valid, target_valid = build_glove_dataset(glove_dataset_dir('valid'), ptb_dataset.valid_data, **cooccurrence_options)
 
 num_train_batch = len(central_train)//batch_size
 num_valid_batch = len(central_valid)//batch_size
 
-def load_train_func(index):
-    return central_train[index], context_train[index], target_train[index]
+def load_train_func(indices):
+    return central_train[indices], context_train[indices], target_train[indices]
 
-def load_valid_func(index):
-    return central_valid[index], context_valid[index], target_valid[index]
+def load_valid_func(indices):
+    return central_valid[indices], context_valid[indices], target_valid[indices]
 
-train_data_iter = data_iterator_simple(load_train_func, len(central_train), batch_size, shuffle=True, with_file_cache=False)
-valid_data_iter = data_iterator_simple(load_valid_func, len(central_valid), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(central_train), batch_size, shuffle=True)
+valid_data_iter = data_iterator_batch(load_valid_func, len(central_valid), batch_size, shuffle=True)
 
 
 x_central = nn.Variable((batch_size, ))
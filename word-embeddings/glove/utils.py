@@ -8,35 +8,170 @@
 
 import numpy as np
 import os
+import shutil
+import tempfile
 
+from concurrent.futures import ProcessPoolExecutor
 from scipy import sparse
 from collections import Counter
 from itertools import combinations
+from pathlib import Path
 from typing import List
 from typing import Tuple
+from typing import Union
 
+from common.utils import Corpus
+from common.utils import DatasetWriter
+from common.utils import open_dataset
+from common.utils import save_dataset
+from common.utils import to_flat
 
-def to_cooccurrences(sentences: List[List[int]], vocab_size: int, window_size: int = 5) -> sparse.lil_matrix:
-    matrix = sparse.lil_matrix((vocab_size, vocab_size))
-    for sentence in sentences:
-        for i, word_id in enumerate(sentence):
-            contexts = sentence[max(0, i - window_size): i]
-            for j, context_id in enumerate(contexts):
-                #distance = len(contexts) - j
-                matrix[word_id, context_id] += 1# / distance
-                # matrix[context_id, word_id] += 1 / distance
+
+def cooccurrence_triples(tokens: np.ndarray, offsets: np.ndarray, distance: int,
+                         distance_weighting: bool = False, symmetric: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Make (central, context, weight) triples of all pairs `distance` apart within a sentence at once.
+    The context precedes the central word unless `symmetric`, in which case the reversed pairs are added too.
+    '''
+    lengths = np.diff(offsets)
+    starts = np.repeat(offsets[:-1], lengths)
+    positions = np.arange(distance, len(tokens))
+    positions = positions[positions - distance >= starts[distance:]]
+    central = tokens[positions]
+    context = tokens[positions - distance]
+    if symmetric:
+        central, context = np.concatenate([central, context]), np.concatenate([context, central])
+    weight = np.full(len(central), 1.0 / distance if distance_weighting else 1.0)
+    return central, context, weight
+
+
+def _count_shard(args: Tuple[np.ndarray, np.ndarray, int, int, bool, bool]) -> sparse.csr_matrix:
+    tokens, offsets, vocab_size, window_size, distance_weighting, symmetric = args
+    matrix = sparse.csr_matrix((vocab_size, vocab_size))
+    for distance in range(1, window_size + 1):
+        # duplicated triples are summed up by the conversion from COO.
+        central, context, weight = cooccurrence_triples(tokens, offsets, distance, distance_weighting, symmetric)
+        matrix += sparse.coo_matrix((weight, (central, context)), shape=(vocab_size, vocab_size)).tocsr()
+    return matrix
+
+
+def to_cooccurrences(sentences: Union[Corpus, List[List[int]]], vocab_size: int, window_size: int = 5,
+                     distance_weighting: bool = False, symmetric: bool = False, num_workers: int = 1) -> sparse.csr_matrix:
+    '''
+    Count co-occurrences of central words (rows) and their preceding context words (columns) within `window_size`.
+    Args:
+        sentences (Union[Corpus, List[List[int]]]): Sentences of word ids.
+        vocab_size (int): The number of words.
+        window_size (int): The maximum distance of context words.
+        distance_weighting (bool): Whether to count a pair `d` words apart as 1/d instead of 1.
+        symmetric (bool): Whether to count the following context words as well.
+        num_workers (int): The number of processes, each of which counts a shard of sentences.
+    Returns:
+        scipy.sparse.csr_matrix: A co-occurrence matrix.
+    '''
+    if isinstance(sentences, Corpus):
+        tokens, offsets = np.asarray(sentences.tokens), np.asarray(sentences.offsets)
+    else:
+        tokens, offsets = to_flat(sentences)
+
+    if num_workers <= 1:
+        return _count_shard((tokens, offsets, vocab_size, window_size, distance_weighting, symmetric))
+
+    # shards are split at sentence boundaries so that no pair crosses them.
+    bounds = np.linspace(0, len(offsets) - 1, num_workers + 1).astype(np.int64)
+    shards = [(tokens[offsets[begin]:offsets[end]], offsets[begin:end+1] - offsets[begin],
+               vocab_size, window_size, distance_weighting, symmetric) for begin, end in zip(bounds[:-1], bounds[1:])]
+    matrix = sparse.csr_matrix((vocab_size, vocab_size))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for shard_matrix in executor.map(_count_shard, shards):
+            matrix += shard_matrix
     return matrix
 
-def to_glove_dataset(sentences: List[List[int]], vocab_size: int, window_size: int = 5) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    matrix = to_cooccurrences(sentences, vocab_size=vocab_size, window_size=window_size)
-    central: List[int] = []
-    context: List[int] = []
-    y: List[int] = []
 
-    for i, j in zip(*matrix.nonzero()):
-        central.append(i)
-        context.append(j)
-        y.append(matrix[i, j])
+def to_glove_dataset(sentences: Union[Corpus, List[List[int]]], vocab_size: int, window_size: int = 5,
+                     distance_weighting: bool = False, symmetric: bool = False,
+                     num_workers: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    matrix = to_cooccurrences(sentences, vocab_size=vocab_size, window_size=window_size,
+                              distance_weighting=distance_weighting, symmetric=symmetric, num_workers=num_workers).tocoo()
+    return matrix.row, matrix.col, matrix.data[:, None]
+
+
+def _spill_shard(args: Tuple[Path, np.ndarray, np.ndarray, int, int, bool, bool]) -> Path:
+    path, tokens, offsets, vocab_size, window_size, distance_weighting, symmetric = args
+    matrix = _count_shard((tokens, offsets, vocab_size, window_size, distance_weighting, symmetric)).tocoo()
+    # entries of a CSR matrix are sorted by (row, column), i.e. by the key row * vocab_size + column.
+    keys = matrix.row.astype(np.int64) * vocab_size + matrix.col
+    save_dataset(path, dict(keys=keys, counts=matrix.data))
+    return path
+
+
+def _merge_shards(path: Path, shard_paths: List[Path], vocab_size: int, block_size: int) -> None:
+    shards = [open_dataset(shard_path)[0] for shard_path in shard_paths]
+    cursors = [0] * len(shards)
+    writer = DatasetWriter(path)
+    writer.append('central', np.zeros(0, dtype=np.int32))
+    writer.append('context', np.zeros(0, dtype=np.int32))
+    writer.append('count', np.zeros((0, 1), dtype=np.float64))
+    while True:
+        active = [i for i, shard in enumerate(shards) if cursors[i] < len(shard['keys'])]
+        if len(active) == 0:
+            break
+        blocks = {i: shards[i]['keys'][cursors[i]:cursors[i]+block_size] for i in active}
+        # every key up to the smallest last key of the blocks is in the blocks, since each shard is sorted.
+        bound = min(block[-1] for block in blocks.values())
+        keys, counts = [], []
+        for i, block in blocks.items():
+            n = np.searchsorted(block, bound, side='right')
+            keys.append(block[:n])
+            counts.append(shards[i]['counts'][cursors[i]:cursors[i]+n])
+            cursors[i] += n
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=np.concatenate(counts), minlength=len(keys))
+        writer.append('central', (keys // vocab_size).astype(np.int32))
+        writer.append('context', (keys % vocab_size).astype(np.int32))
+        writer.append('count', counts[:, None])
+    writer.close()
+
+
+def build_glove_dataset(path: Path, sentences: Union[Corpus, List[List[int]]], vocab_size: int, window_size: int = 5,
+                        distance_weighting: bool = False, symmetric: bool = False, num_workers: int = 1,
+                        shard_size: int = 1 << 22, block_size: int = 1 << 20) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    An out-of-core counterpart of `to_glove_dataset`. Co-occurrences of every shard of about
+    `shard_size` tokens are counted and spilled to disk sorted by (central, context),
+    then the shards are merged block by block (a k-way merge), summing counts of the same pair.
+    The result is saved into the directory `path` and reused if it already exists.
+    Args:
+        path (pathlib.Path): A directory of the dataset.
+        shard_size (int): The approximate number of tokens of a shard.
+        block_size (int): The number of entries of a shard read at once while merging.
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: Memory-mapped central words, context words and counts,
+                                                            in the same order as `to_glove_dataset`.
+    '''
+    path = Path(path)
+    if not path.exists():
+        if isinstance(sentences, Corpus):
+            tokens, offsets = np.asarray(sentences.tokens), np.asarray(sentences.offsets)
+        else:
+            tokens, offsets = to_flat(sentences)
+        bounds = np.unique(np.searchsorted(offsets, np.arange(0, offsets[-1], shard_size)).tolist() + [len(offsets) - 1])
+        bounds = bounds[bounds < len(offsets)]
 
-    return np.array(central), np.array(context), np.array(y)[:, None]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(dir=path.parent, prefix=f'.{path.name}-shards-'))
+        try:
+            shards = [(tmp_path / f'shard_{k}', tokens[offsets[begin]:offsets[end]], offsets[begin:end+1] - offsets[begin],
+                       vocab_size, window_size, distance_weighting, symmetric)
+                      for k, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+            if num_workers <= 1:
+                shard_paths = list(map(_spill_shard, shards))
+            else:
+                with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                    shard_paths = list(executor.map(_spill_shard, shards))
+            _merge_shards(path, shard_paths, vocab_size, block_size)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
 
+    columns, _ = open_dataset(path)
+    return columns['central'], columns['context'], columns['count']
@@ -18,20 +18,22 @@ import nnabla.initializer as I
 import nnabla.solvers as S
 import nnabla.monitor as M
 
-from nnabla.utils.data_iterator import data_iterator_simple
-
 from common.parametric_functions import lstm
 from common.functions import time_distributed
 from common.functions import time_distributed_softmax_cross_entropy
 from common.functions import get_mask
 from common.functions import expand_dims
+from common.functions import logsumexp
 
+from common.data_iterator import data_iterator_batch
 from common.trainer import Trainer
 
+from utils import NegativeSampler
+
 from nnabla.utils.data_source_loader import download
 from nnabla.utils.data_source_loader import get_data_home
 
-from typing import Dict, Union
+from typing import Dict, List, Optional, Union
 
 import argparse
 parser = argparse.ArgumentParser(description='GloVe model training.')
@@ -39,6 +41,9 @@ parser.add_argument('--context', '-c', type=str,
                     default='cpu', help='You can choose cpu or cudnn.')
 parser.add_argument('--device', '-d', type=int,
                     default=0, help='You can choose the device id when you use cudnn.')
+parser.add_argument('--data', type=str,
+                    default='https://raw.githubusercontent.com/qiangsiwei/poincare_embedding/master/data/mammal_subtree.tsv',
+                    help='A URL or a path of a tsv file of relations, e.g. the transitive closure of WordNet nouns.')
 args = parser.parse_args()
 
 if args.context == 'cudnn':
@@ -52,49 +57,56 @@ if args.context == 'cudnn':
 
 
 embedding_size: int = 2
-batch_size: int = 1
+batch_size: int = 256
 max_epoch: int = 50
+burn_in_epochs: int = 10
 negative_sample_size = 10
+lr: float = 0.1
 
-file_url = 'https://raw.githubusercontent.com/qiangsiwei/poincare_embedding/master/data/mammal_subtree.tsv'
-
-from functools import reduce
-import operator
-import random
-
-with download(file_url, open_file=True) as f:
+if args.data.startswith(('http://', 'https://')):
+    f = download(args.data, open_file=True)
+else:
+    f = open(args.data, 'rb')
+with f:
     lines: str = f.read().decode('utf-8').split('\n')
     pdata = list(map(lambda l:l.split('\t'),filter(None,lines)))
 
-pdict = {w:i for i,w in enumerate(set(reduce(operator.add, pdata)))}
+pdict = {w:i for i,w in enumerate(set(w for pair in pdata for w in pair))}
 
 vocab_size: int = len(pdict)
-num_train_batch = len(pdata)//batch_size
 
-def load_train_func(index):
-    x, y = pdata[index]
-    negative_sample_prob = np.ones(len(pdict))
-    negative_sample_prob[pdict[x]] = 0.0
-    negative_sample_prob[pdict[y]] = 0.0
-    negative_sample_prob /= len(pdict) - 2
-    negative_sample_indices = np.random.choice(range(len(pdict)), negative_sample_size, 
-                                               replace=False, p=negative_sample_prob)
-    return pdict[x], pdict[y], negative_sample_indices
+edges = np.array([[pdict[x], pdict[y]] for x, y in pdata], dtype=np.int32)
+# negatives of a whole batch are drawn at once, excluding known neighbors.
+sampler = NegativeSampler(edges, vocab_size, k=negative_sample_size)
+
+def load_train_func(indices):
+    u, v = edges[indices, 0], edges[indices, 1]
+    return u, v, sampler(u, v)
 
-train_data_iter = data_iterator_simple(load_train_func, len(pdata), batch_size, shuffle=True, with_file_cache=False)
+train_data_iter = data_iterator_batch(load_train_func, len(edges), batch_size, shuffle=True)
 
 
 """
 """
 
 def distance(u, v, eps=1e-5):
-    uu = F.sum(F.pow_scalar(u, 2), axis=1)
-    vv = F.sum(F.pow_scalar(v, 2), axis=1)
-    euclid_norm_pow2 = F.sum(F.pow_scalar(u - v, 2), axis=1)
-    alpha = F.maximum2(F.constant(eps, shape=uu.shape), 1.0 - uu)
-    beta = F.maximum2(F.constant(eps, shape=vv.shape), 1.0 - vv)
-
-    return F.acosh(1 + 2 * euclid_norm_pow2 / (alpha * beta))
+    '''
+    The Poincaré distance along the last axis.
+    Args:
+        u (nnabla.Variable): A shape of (..., embedding_size).
+        v (nnabla.Variable): The same shape as u.
+    Returns:
+        nnabla.Variable: A shape of (...).
+    '''
+    axis = u.ndim - 1
+    uu = F.sum(F.pow_scalar(u, 2), axis=axis)
+    vv = F.sum(F.pow_scalar(v, 2), axis=axis)
+    euclid_norm_pow2 = F.sum(F.pow_scalar(u - v, 2), axis=axis)
+    alpha = F.maximum_scalar(1.0 - uu, eps)
+    beta = F.maximum_scalar(1.0 - vv, eps)
+
+    # the argument is kept above 1, where the gradient of acosh is finite even for (nearly) identical points.
+    return F.acosh(F.maximum_scalar(1 + 2 * euclid_norm_pow2 / (alpha * beta), 1 + eps))
 
 
 def projection(x: nn.NdArray, eps: float = 1e-5) -> nn.NdArray:
@@ -104,49 +116,90 @@ def projection(x: nn.NdArray, eps: float = 1e-5) -> nn.NdArray:
                    x_false=x)
 
 class RiemannianSgd(S.Solver):
-    def __init__(self, lr=0.01, eps=1e-5):
+    '''
+    Riemannian SGD in the Poincaré ball.
+    With `index_variables`, only the rows of the embedding matrices referenced by them
+    (i.e. the entities in the current batch) are rescaled, updated and projected,
+    so that the cost of a step depends on the batch size, not the vocabulary size.
+    Args:
+        lr (float): A learning rate.
+        eps (float): Rows are projected into the ball of radius 1 - eps.
+        index_variables (List[nnabla.Variable]): Input variables of entity ids.
+    '''
+    def __init__(self, lr=0.01, eps=1e-5, index_variables: Optional[List[nn.Variable]] = None):
         self.lr = lr
         self.eps = eps
+        self.index_variables = index_variables
     
     def set_parameters(self, params: Dict[str, nn.Variable]):
         self.params = params
 
+    def _rows(self) -> np.ndarray:
+        return np.unique(np.concatenate([variable.d.reshape(-1) for variable in self.index_variables]).astype(np.int64))
+
     def zero_grad(self):
+        if self.index_variables is not None:
+            # gradients are accumulated only into the rows of the current batch.
+            rows = self._rows()
+            for key in self.params:
+                self.params[key].g[rows] = 0
+            return
         for key in self.params:
             self.params[key].grad.zero()
 
     def update(self):
+        if self.index_variables is not None:
+            rows = self._rows()
+            for key in self.params:
+                data, grad = self.params[key].d, self.params[key].g[rows]
+                if not np.isfinite(grad).all():
+                    raise FloatingPointError(f'the gradient of {key} is not finite.')
+                x = data[rows]
+                x -= self.lr * grad * (1. - np.sum(x**2, axis=1, keepdims=True))**2 / 4.
+                norm = np.linalg.norm(x, axis=1, keepdims=True)
+                data[rows] = np.where(norm >= 1., x * (1 - self.eps) / np.maximum(norm, 1.), x)
+            return
         for key in self.params:
             rescaled_gradient: nn.NdArray = self.params[key].grad * (1. - F.sum(self.params[key].data**2, axis=1, keepdims=True))**2 / 4. 
-            if np.inf in self.params[key].grad.data:
+            if not np.isfinite(self.params[key].g).all():
                 print(self.params[key].grad.data)
                 exit()
             self.params[key].data -= self.lr * rescaled_gradient
             self.params[key].data = projection(self.params[key].data, eps=self.eps)
 
 def loss_function(u, v, negative_samples):
-    return F.sum(-F.log(F.exp(-distance(u, v)) / sum([F.exp(-distance(u, x)) for x in F.split(negative_samples, axis=2)])))
-
-
+    '''
+    -log(exp(-d(u, v)) / sum(exp(-d(u, v')))) over negative samples v', summed over a batch.
+    Args:
+        u (nnabla.Variable): A shape of (batch_size, 1, embedding_size).
+        v (nnabla.Variable): A shape of (batch_size, 1, embedding_size).
+        negative_samples (nnabla.Variable): A shape of (batch_size, k, embedding_size).
+    '''
+    positive_distance = F.reshape(distance(u, v), shape=(u.shape[0], ))
+    negative_distance = distance(F.broadcast(u, shape=negative_samples.shape), negative_samples)
+    return F.sum(positive_distance + logsumexp(-negative_distance, axis=1))
 
 
 u = nn.Variable((batch_size,))
 v = nn.Variable((batch_size,))
 negative_samples = nn.Variable((batch_size, negative_sample_size))
 
-_u = PF.embed(u, vocab_size, embedding_size)
-_v = PF.embed(v, vocab_size, embedding_size)
+_u = F.reshape(PF.embed(u, vocab_size, embedding_size), shape=(batch_size, 1, embedding_size))
+_v = F.reshape(PF.embed(v, vocab_size, embedding_size), shape=(batch_size, 1, embedding_size))
 _neg = PF.embed(negative_samples, vocab_size, embedding_size)
-_neg = F.transpose(_neg, axes=(0, 2, 1))
 
 loss = loss_function(_u, _v, _neg)
 
 nn.get_parameters()["embed/W"].d = I.UniformInitializer([-0.01, 0.01])(shape=(vocab_size, embedding_size))
 
-solver = RiemannianSgd(lr=0.1)
+solver = RiemannianSgd(lr=lr, index_variables=[u, v, negative_samples])
 solver.set_parameters(nn.get_parameters())
 
 trainer = Trainer(inputs=[u, v, negative_samples], loss=loss, solver=solver)
+# embeddings are placed roughly with a small learning rate first (burn-in).
+solver.lr = lr / 10
+trainer.run(train_data_iter, None, epochs=burn_in_epochs)
+solver.lr = lr
 trainer.run(train_data_iter, None, epochs=max_epoch)
 
 
@@ -187,6 +240,8 @@ for w,i in pdict.items():
     ax.text(c0+.01,c1+.01,w,color='b')
 for line in line_points:
     a, b = line
+    if a not in pdict or b not in pdict:
+        continue
     a, b = pdict[a], pdict[b]
     a, b = nn.get_parameters()["embed/W"].d[a], nn.get_parameters()["embed/W"].d[b]
     a, b = np.array([a, b]).T
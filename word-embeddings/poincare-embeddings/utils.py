@@ -0,0 +1,72 @@
+#
+# Copyright (c) 2017-2019 Minato Sato
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import numpy as np
+
+from typing import Optional
+
+
+class NegativeSampler(object):
+    '''
+    A sampler of negative examples of Poincaré embeddings for a whole batch at once.
+    For a relation (u, v), `k` distinct entities other than u and v are drawn uniformly,
+    and with `exclude_neighbors`, entities v' of known relations (u, v') are excluded as well.
+    Known relations are looked up in a sorted array of edge keys, so no vocabulary-sized
+    array is allocated per sample.
+    Args:
+        edges (numpy.ndarray): Known relations of a shape (number_of_relations, 2).
+        vocab_size (int): The number of entities.
+        k (int): The number of negative samples per relation.
+        exclude_neighbors (bool): Whether to exclude all known neighbors of u.
+        rng (numpy.random.RandomState): A random number generator.
+    '''
+    def __init__(self, edges: np.ndarray, vocab_size: int, k: int = 10, exclude_neighbors: bool = True,
+                 rng: Optional[np.random.RandomState] = None) -> None:
+        edges = np.asarray(edges, dtype=np.int64)
+        self.vocab_size = vocab_size
+        self.k = k
+        self.exclude_neighbors = exclude_neighbors
+        self.rng = rng if rng is not None else np.random.RandomState(313)
+        self.edge_keys = np.unique(edges[:, 0] * vocab_size + edges[:, 1])
+
+        max_excluded = 2
+        if exclude_neighbors and len(edges) > 0:
+            max_excluded += np.bincount(self.edge_keys // vocab_size).max()
+        assert vocab_size - max_excluded >= k, f'there are not enough candidates to draw {k} negative samples.'
+
+    def _is_neighbor(self, u: np.ndarray, samples: np.ndarray) -> np.ndarray:
+        keys = u * self.vocab_size + samples
+        positions = np.minimum(np.searchsorted(self.edge_keys, keys), len(self.edge_keys) - 1)
+        return self.edge_keys[positions] == keys
+
+    def _invalid(self, u: np.ndarray, v: np.ndarray, samples: np.ndarray) -> np.ndarray:
+        invalid = (samples == u) | (samples == v)
+        if self.exclude_neighbors and len(self.edge_keys) > 0:
+            invalid |= self._is_neighbor(u, samples)
+        # only the first of the same samples in a row is kept.
+        order = np.argsort(samples, axis=1, kind='stable')
+        sorted_samples = np.take_along_axis(samples, order, axis=1)
+        duplicated = np.zeros(samples.shape, dtype=bool)
+        duplicated[:, 1:] = sorted_samples[:, 1:] == sorted_samples[:, :-1]
+        np.put_along_axis(duplicated, order, duplicated.copy(), axis=1)
+        return invalid | duplicated
+
+    def __call__(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        '''
+        Draw negative samples. Invalid samples are drawn again until all of them are valid.
+        Returns:
+            numpy.ndarray: A shape of (len(u), k).
+        '''
+        u = np.asarray(u, dtype=np.int64).reshape(-1, 1)
+        v = np.asarray(v, dtype=np.int64).reshape(-1, 1)
+        samples = self.rng.randint(self.vocab_size, size=(len(u), self.k))
+        invalid = self._invalid(u, v, samples)
+        while invalid.any():
+            samples[invalid] = self.rng.randint(self.vocab_size, size=np.count_nonzero(invalid))
+            invalid = self._invalid(u, v, samples)
+        return samples